@@ -4,23 +4,30 @@ import os
 import signal
 import json
 import random
-import subprocess
-from file_read_backwards import FileReadBackwards
 import re
+import struct
 import sys
+import time
+import traceback
 
 from sourceserver.exceptions import SourceError
 
 from src.interface import Context, Embed, IEmoji, IGuild, IMessage, IRole, IUser, Masquerade, Permission
 from src.config import Backend, Config, MessageFormats
 from src.data import Server, Servers
-from src.utils import formatTimedelta, Colour
+from src.utils import formatTimedelta, parseDuration, packMessages, keepTask, Colour, Debouncer
 from src.relay import Relay
+from src.scheduler import Priority, SendScheduler
 from src.infopayload import InfoPayload
+from src.query import QueryEngine
+from src.health import Health, HealthScheduler
+from src.history import History, MAX_WINDOW
+from src.notifier import Notifier
+from src.shell import runCommand
+from src.logsearch import LogSearcher
+from src.logtail import LogFollower
 from src.cli import getCLIArgs
 
-IP_PATTERN = re.compile("(?:(?:[0-9]|[0-9][0-9]|1[0-9][0-9]|2[0-4][0-9]|25[0-5])\.){3}(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[0-9][0-9]|[0-9])")
-
 args = getCLIArgs()
 
 config = None
@@ -47,12 +54,28 @@ with open(args.data, mode) as f:
 
 data = Servers(data)
 
+# Ping and player count history is kept next to the data file
+historyPath = os.path.splitext(args.data)[0] + ".history"
+history = History()
+if os.path.exists(historyPath):
+	try: history.load(historyPath)
+	except (OSError, ValueError, EOFError, struct.error) as e: print(f"Failed to load history, starting afresh ({e})")
+
+# Search indexes of configured logs are kept next to the data file too
+logIndexPath = os.path.splitext(args.data)[0] + ".logindex"
+
+def saveHistory():
+	history.prune({server.constr for _, server in data})
+	history.save(historyPath)
+
 # Register clean shutdown function
 def onExit(_signo, _stack_frame):
 	print("Performing safe shutdown")
 
 	with open(args.data, "w+") as f:
 		json.dump(data.encode(), f)
+	saveHistory()
+	logSearcher.close()
 
 	sys.exit(0)
 
@@ -60,10 +83,23 @@ signal.signal(signal.SIGINT, onExit)
 signal.signal(signal.SIGTERM, onExit)
 
 bot = Bot(token, config)
-relay = Relay(config.relayPort, config.isRunningBehindCloudflare)
-autoclosed = []
+scheduler = SendScheduler(config.sendScheduler)
+notifier = Notifier(scheduler, config.notifier)
+relay = Relay(config.relayPort, config.isRunningBehindCloudflare, config.relayDnsTTL, config.relayMaxLongPoll, config.relayQueues)
+query = QueryEngine(config.queryTimeout, config.queryRetries, config.queryCache)
+health = HealthScheduler(config.healthCheck)
+probes: set[asyncio.Task] = set()
+encodes: set[asyncio.Task] = set() # Info payloads being encoded ahead of time
+restarting: set[str] = set() # Channels with a restart command running
+logSearcher = LogSearcher(config.logSearchWorkers, config.logSearchTimeout, indexDir=logIndexPath if config.logIndexInterval else None)
+logFollowers: dict[str, LogFollower] = {} # Channel ID -> follower of its log
+autoclosed: set[str] = set()
 infoPayloads: dict[int, InfoPayload] = {}
 
+@bot.task
+async def startRelay():
+	await relay.start()
+
 async def checkChannelBound(ctx: Context) -> bool:
 	if data.channelBound(ctx.channel): return True
 
@@ -86,7 +122,7 @@ def getGuildInfo(guild: IGuild) -> InfoPayload:
 	'''Get the appropriate InfoPayload for this context, or create one if none exists'''
 	if guild.id not in infoPayloads:
 		# Create an info payload for this guild if none exists
-		payload = InfoPayload(config.backend)
+		payload = InfoPayload(config.backend, config.infoPayloadMembers)
 		
 		payload.setRoles(guild.roles)
 		payload.setEmojis(guild.emojis)
@@ -100,7 +136,7 @@ def setupConStr(guild: IGuild, constr: str):
 	relay.addConStr(constr)
 	payload = getGuildInfo(guild)
 	payload.addConStr(constr)
-	relay.setInitPayload(constr, payload.encode())
+	relay.setInitPayload(constr, payload)
 
 def removeConStr(guild: IGuild, constr: str):
 	'''Perform deinitialisation of a relaying constring'''
@@ -122,8 +158,8 @@ async def connect(ctx: Context, connectionString: str):
 		await ctx.reply(f"This channel is connected to `{existingConnection}`, use `{config.prefix}disconnect` first to connect to a different server")
 		return
 
-	# Attempt to connect to the server provided
-	try: server = Server(connectionString, False)
+	# Attempt to connect to the server provided (off the event loop, as the initial connection blocks)
+	try: server = await asyncio.get_running_loop().run_in_executor(None, Server, connectionString, False)
 	except SourceError as e: await ctx.reply("Error, " + e.message.split(" | ")[1])
 	except ValueError: await ctx.reply("Connection string invalid")
 	else:
@@ -141,6 +177,8 @@ async def disconnect(ctx: Context):
 	if data[ctx.channel].relay:
 		removeConStr(ctx.guild, data[ctx.channel].constr)
 
+	query.forget(data[ctx.channel])
+	if ctx.channel.id in logFollowers: logFollowers.pop(ctx.channel.id).stop()
 	data.unbindChannel(ctx.channel)
 	await ctx.reply("Connection removed successfully!")
 
@@ -170,34 +208,22 @@ async def retry(ctx: Context):
 		await ctx.reply("Server is already connected")
 		return
 
-	data[ctx.channel].retry()
-	if data[ctx.channel].isClosed:
+	if not await query.retry(data[ctx.channel]):
 		await ctx.reply("Failed to reconnect to server")
 	else:
-		if data[ctx.channel]:
+		if data[ctx.channel].relay:
 			setupConStr(ctx.guild, data[ctx.channel].constr)
 		
-		data[ctx.channel].timeSinceDown = -1
+		data[ctx.channel].downSince = None
+		health.report(ctx.channel.id, Health.Up)
 		await ctx.reply("Successfully reconnected to server!")
 
 		if ctx.channel.id in autoclosed:
-			# Create a list of all valid user IDs
-			# This works by appending to this list every valid ID, then setting the toNotify list to this list of valid IDs
-			validIDs = []
-
-			# For every person set to be notified, send them a DM to say the server is back online
-			for personToNotify in data[ctx.channel].toNotify:
-				member = await ctx.guild.fetchMember(personToNotify)
-				if not member: continue
-
-				validIDs.append(personToNotify)
-
-				await member.send(f'''
-				The Source Dedicated Server `{data[ctx.channel]._info["name"] if data[ctx.channel]._info != {} else "unknown"}` @ `{data[ctx.channel].constr}` assigned to this bot just came back up!\n*You are receiving this message as you are set to be notified regarding server outage at `{ctx.guild.name}`*
-				''')
-
-			data[ctx.channel].toNotify = validIDs
-			autoclosed.remove(ctx.channel.id)
+			# Tell everyone set to be notified that the server is back online
+			notifier.notify(ctx.guild, data[ctx.channel], f'''
+			The Source Dedicated Server `{data[ctx.channel]._info["name"] if data[ctx.channel]._info != {} else "unknown"}` @ `{data[ctx.channel].constr}` assigned to this bot just came back up!\n*You are receiving this message as you are set to be notified regarding server outage at `{ctx.guild.name}`*
+			''')
+			autoclosed.discard(ctx.channel.id)
 
 @bot.command
 async def constring(ctx: Context):
@@ -212,12 +238,22 @@ async def status(ctx: Context):
 	if not await checkChannelOnline(ctx): return
 
 	ping = None
-	try: ping = data[ctx.channel].ping()
+	try: ping = await query.ping(data[ctx.channel])
 	except SourceError as e:
 		await ctx.reply(f"Connection to server isn't closed internally, however failed to ping the server with exception `{e.message}`")
 		return
 
-	await ctx.reply(f"Server online, ping {ping:.0f}. (Note that the ping is from the location of the bot)")
+	response = f"Server online, ping {ping:.0f}. (Note that the ping is from the location of the bot)"
+
+	constr = data[ctx.channel].constr
+	if data[ctx.channel].relay and relay.isConStrAdded(constr):
+		# Surface relay events lost to full queues or expiry, a sign that a client has stopped polling or the limits are too low
+		dropped = relay.getDropped(constr)
+		lost = [f"{count} {kind} to the server" for kind, count in dropped["discord"].items() if count]
+		lost += [f"{count} {kind} from the server" for kind, count in dropped["source"].items() if count]
+		if lost: response += "\nRelay events dropped or expired: " + ", ".join(lost)
+
+	await ctx.reply(response)
 
 @bot.command
 async def info(ctx: Context, infoName: str = None):
@@ -225,7 +261,7 @@ async def info(ctx: Context, infoName: str = None):
 	if not await checkChannelBound(ctx): return
 	if not await checkChannelOnline(ctx): return
 
-	try: info = data[ctx.channel].info
+	try: info = await query.info(data[ctx.channel])
 	except SourceError as e:
 		await ctx.reply("Unable to get info")
 		print(e.message)
@@ -275,8 +311,8 @@ async def players(ctx: Context):
 
 	# Get server details
 	try:
-		info = data[ctx.channel].info
-		count, plrs = data[ctx.channel].getPlayers()
+		info = await query.info(data[ctx.channel])
+		count, plrs = await query.players(data[ctx.channel])
 		isTheShip = info["game"] == "The Ship"
 		srvName = info["name"]
 	except SourceError as e:
@@ -320,7 +356,7 @@ async def rules(ctx: Context, ruleName: str = None):
 	if not await checkChannelBound(ctx): return
 	if not await checkChannelOnline(ctx): return
 
-	try: rules = data[ctx.channel].rules
+	try: rules = await query.rules(data[ctx.channel])
 	except SourceError as e:
 		await ctx.reply("Unable to get rules")
 		print(e.message)
@@ -360,6 +396,40 @@ async def rules(ctx: Context, ruleName: str = None):
 
 	await ctx.reply(f"{ruleName}: {rules[ruleName]}")
 
+@bot.command
+async def stats(ctx: Context, window: str = "1d"):
+	'''
+	Shows the server's uptime, ping and peak players over a window of time (1d by default)  
+	Windows are a number followed by m, h, d, w, or y, such as 6h or 30d
+	'''
+	if not await checkChannelBound(ctx): return
+
+	seconds = parseDuration(window)
+	if seconds is None or seconds <= 0:
+		await ctx.reply(f"'{window}' isn't a valid window, try something like `6h`, `7d`, or `1y`")
+		return
+	if seconds > MAX_WINDOW:
+		await ctx.reply(f"History only goes back {formatTimedelta(timedelta(seconds=MAX_WINDOW))}, try a shorter window")
+		return
+
+	server = data[ctx.channel]
+	result = history[server.constr].stats(seconds)
+	if result.samples == 0:
+		await ctx.reply("No history has been recorded for this server over that window yet")
+		return
+
+	embed = Embed(
+		title="Server Stats",
+		description=f"Over the last {formatTimedelta(timedelta(seconds=seconds))}",
+		colour=config.accentColour
+	)
+	embed.addField(name="Uptime", value=f"{result.uptime * 100:.2f}%")
+	embed.addField(name="Ping (p50/p95)", value=f"{result.pingP50:.0f}/{result.pingP95:.0f} ms" if result.pingP50 is not None else "n/a")
+	embed.addField(name="Peak Players", value=str(result.peakPlayers) if result.peakPlayers is not None else "n/a")
+	embed.footer = f"{result.samples} checks, ping percentiles are of {formatTimedelta(timedelta(seconds=result.resolution))} averages"
+
+	await ctx.reply(embed=embed)
+
 @bot.command
 async def notify(ctx: Context, target: IUser = None):
 	'''
@@ -415,20 +485,18 @@ async def peopleToNotify(ctx: Context):
 		await ctx.reply(f"No one is set to be notified regarding server outage\n*use `{config.prefix}notify` to set someone to be notified, and `{config.prefix}dontNotify` to disable notifications*")
 		return
 
-	# As with the actual ping task, we save a list of valid IDs and replace the existing list with this one after the loop
-	validIDs = []
+	# As with outage notifications, anyone that's no longer in the guild is removed from the list
+	server = data[ctx.channel]
+	members = await notifier.members(ctx.guild, list(server.toNotify))
+	notifier.prune(server, members)
 
 	# Message to be sent
 	msg = "*The following people are set to be notified regarding outage from the server linked to this channel:*\n"
 
-	for userID in data[ctx.channel].toNotify:
-		member = await ctx.guild.fetchMember(userID)
+	for userID, member in members.items():
 		if not member: continue
-
-		validIDs.append(userID)
 		msg += (str(ctx.author) if ctx.author.id == userID else f"`{member.displayName}`") + ", "
 
-	data[ctx.channel].toNotify = validIDs
 	await ctx.reply(msg[:-2])
 
 @bot.command
@@ -522,21 +590,32 @@ async def restart(ctx: Context, configure: str = None):
 		await ctx.reply(f"A restart command is not configured for this channel, use `{config.prefix}restart configure [command]` to set one up")
 		return
 
-	msg = await ctx.reply("Running restart command...")
-	result = subprocess.run(restartCmd, shell=True, capture_output=True, encoding="utf-8")
+	if ctx.channel.id in restarting:
+		await ctx.reply("The restart command is already running for this channel")
+		return
+
+	restarting.add(ctx.channel.id)
+	try:
+		msg = await ctx.reply("Running restart command...")
 
-	output = "No output"
-	if result.stdout:
-		output = result.stdout
-	elif result.stderr:
-		output = result.stderr
+		# Output is streamed into the message as the command runs, at most once per edit interval
+		async def showOutput(output: str):
+			await msg.edit("Running restart command...\n```ansi\n" + output + "\n```")
 
-	await msg.edit("```ansi\n" + output + "\n```")
+		result = await runCommand(restartCmd, showOutput, config.restartTimeout, config.restartEditInterval)
+	finally:
+		restarting.discard(ctx.channel.id)
+
+	output = result.output if result.output else "No output"
+	if result.timedOut:
+		await msg.edit(f"Restart command timed out after {config.restartTimeout:g} seconds and was killed\n```ansi\n{output}\n```")
+	else:
+		await msg.edit("```ansi\n" + output + "\n```")
 
 @bot.command
 async def log(ctx: Context, mode: str = None):
 	'''
-	Outputs latest entries in a logfile with regex search and IP filtering
+	Outputs latest entries in a logfile with regex search and IP filtering, or follows new entries into the channel
 	'''
 	if not await checkChannelBound(ctx): return
 
@@ -552,7 +631,16 @@ async def log(ctx: Context, mode: str = None):
 			await ctx.reply("No log path specified")
 			return
 
+		changed = logPath != data[ctx.channel].logPath
 		data[ctx.channel].logPath = logPath
+
+		follower = logFollowers.pop(ctx.channel.id, None) if changed else None
+		if follower is not None and follower.running:
+			# It would carry on tailing the old file
+			follower.stop()
+			await ctx.reply(f"Log path set, stopped following the old log file. Use `{config.prefix}log follow` to follow the new one")
+			return
+
 		await ctx.reply("Log path set")
 		return
 
@@ -561,153 +649,246 @@ async def log(ctx: Context, mode: str = None):
 		await ctx.reply(f"A log path is not configured for this channel, use `{config.prefix}log configure [path]` to set one up")
 		return
 
+	if mode == "follow":
+		search = ctx.message.cleanContent[len(config.prefix) + len("log follow"):].strip()
+
+		try: follower = LogFollower(scheduler, logSearcher, ctx.channel, logPath, search, config.logFollowInterval)
+		except re.error as e:
+			await ctx.reply(f"Invalid search pattern ({e})")
+			return
+
+		try: await follower.start()
+		except OSError:
+			await ctx.reply("Failed to read log file")
+			return
+
+		previous = logFollowers.get(ctx.channel.id)
+		if previous is not None: previous.stop()
+		logFollowers[ctx.channel.id] = follower
+
+		await ctx.reply(f"Following the log file{' for lines matching your search' if search else ''}, use `{config.prefix}log unfollow` to stop")
+		return
+
+	if mode == "unfollow":
+		follower = logFollowers.pop(ctx.channel.id, None)
+		if follower is None or not follower.running:
+			await ctx.reply("This channel isn't following its log file")
+			return
+
+		follower.stop()
+		await ctx.reply("Stopped following the log file")
+		return
+
 	search = ctx.message.cleanContent[len(config.prefix) + len("log"):].strip()
 
-	try:
-		matchedLines = []
-		totalStrLen = 0
-		with FileReadBackwards(logPath) as f:
-			for line in f:
-				line = re.sub(IP_PATTERN, "\033[0;31m███.███.███.███\033[0m", line)
-				if search:
-					(line, matches) = re.subn(search, lambda match: "\033[1;32m" + match.group() + "\033[0m", line)
-					if matches < 1: continue
-
-				matchedLines.append(line)
-				totalStrLen += len(line) + 1 # add 1 for newline char
-				if totalStrLen > 1000: break
-	except:
+	try: result = await logSearcher.search(logPath, search)
+	except re.error as e:
+		await ctx.reply(f"Invalid search pattern ({e})")
+		return
+	except Exception:
 		await ctx.reply("Failed to read log file")
-	else:
-		numMatchedLines = len(matchedLines)
-		if numMatchedLines == 0:
+		return
+
+	matchedLines = result.lines
+	if len(matchedLines) == 0:
+		if result.timedOut:
+			await ctx.reply(f"Search timed out after {config.logSearchTimeout:g} seconds without finding anything")
+		else:
 			await ctx.reply("Nothing found (either the logfile is empty or your search pattern returned no results)")
-			return
+		return
 
-		matchedLines.reverse()
-		await ctx.reply("Found `{numMatchedLines}` lines\n```ansi\n{output}\n```".format(
-			numMatchedLines = len(matchedLines),
-			output = "\n".join(matchedLines)
-		))
+	await ctx.reply("Found `{numMatchedLines}` lines{timedOut}\n```ansi\n{output}\n```".format(
+		numMatchedLines = len(matchedLines),
+		timedOut = f" (search timed out after {config.logSearchTimeout:g} seconds)" if result.timedOut else "",
+		output = "\n".join(matchedLines)
+	))
 
-@bot.loop(60)
-async def pingServer():
-	await bot.waitUntilReady()
+async def checkServer(channelID: str, server: Server) -> Health:
+	'''Pings a server, notifying people if it's gone down or come back up'''
+	if server.isClosed:
+		if not channelID in autoclosed: return Health.Idle # If the server was closed manually there's nothing to check
 
-	for channelID, server in data:
-		if server.isClosed:
-			if not channelID in autoclosed: continue # If the server was closed manually just continue
+		# Attempt to retry the connection to the server
+		if not await query.retry(server):
+			history[server.constr].record(False)
+			return Health.Down
+		history[server.constr].record(True, players=server._info.get("players"))
 
-			# Attempt to retry the connection to the server
-			server.retry()
-			if not server.isClosed:
-				guild = bot.getChannel(channelID).guild
+		guild = bot.getChannel(channelID).guild
 
-				if server.relay:
-					setupConStr(guild, server.constr)
+		if server.relay:
+			setupConStr(guild, server.constr)
 
-				server.timeSinceDown = -1
+		server.downSince = None
 
-				# Create a list of all valid user IDs
-				# This works by appending to this list every valid ID, then setting the toNotify list to this list of valid IDs
-				validIDs = []
+		# Tell everyone set to be notified that the server is back online
+		notifier.notify(guild, server, f'''
+		The Source Dedicated Server `{server._info["name"] if server._info != {} else "unknown"}` @ `{server.constr}` assigned to this bot just came back up!\n*You are receiving this message as you are set to be notified regarding server outage at `{guild.name}`*
+		''')
+		autoclosed.discard(channelID)
+		return Health.Up
 
-				# For every person set to be notified, send them a DM to say the server is back online
-				for personToNotify in server.toNotify:
-					member = await guild.fetchMember(personToNotify)
-					if not member: continue
+	try:
+		ping = await query.ping(server, 1)
+	except SourceError:
+		history[server.constr].record(False)
+		if server.downSince is None: server.downSince = time.monotonic()
+		if time.monotonic() - server.downSince < config.timeDownBeforeNotify * 60: return Health.Failing
 
-					validIDs.append(personToNotify)
+		guild = bot.getChannel(channelID).guild
 
-					guildName = guild.name
-					await member.send(f'''
-					The Source Dedicated Server `{server._info["name"] if server._info != {} else "unknown"}` @ `{server.constr}` assigned to this bot just came back up!\n*You are receiving this message as you are set to be notified regarding server outage at `{guildName}`*
-					''')
+		notifier.notify(guild, server, f'''
+		**WARNING:** The Source Dedicated Server `{server._info["name"] if server._info != {} else "unknown"}` @ `{server.constr}` assigned to this bot is down!\n*You are receiving this message as you are set to be notified regarding server outage at `{guild.name}`*
+		''')
 
-				server.toNotify = validIDs
-				autoclosed.remove(channelID)
-			continue
+		server.close()
+		if server.relay:
+			removeConStr(guild, server.constr)
 
-		try:
-			server.ping()
-		except SourceError:
-			server.timeSinceDown += 1
-			if server.timeSinceDown < config.timeDownBeforeNotify: continue
+		autoclosed.add(channelID)
+		return Health.Down
 
-			guild = bot.getChannel(channelID).guild
+	history[server.constr].record(True, ping, server._info.get("players"))
+	server.downSince = None
+	return Health.Up
 
-			# Create a list of all valid user IDs
-			# This works by appending to this list every valid ID, then setting the toNotify list to this list of valid IDs
-			validIDs = []
+async def probeServer(channelID: str, server: Server):
+	try: result = await checkServer(channelID, server)
+	except Exception as err:
+		traceback.print_exception(type(err), err, err.__traceback__)
+		result = Health.Failing
 
-			for personToNotify in server.toNotify:
-				member = await guild.fetchMember(personToNotify)
-				if not member: continue
+	health.report(channelID, result)
 
-				validIDs.append(personToNotify)
+@bot.loop(0)
+async def pingServer():
+	await bot.waitUntilReady()
 
-				guildName = guild.name
-				await member.send(f'''
-				**WARNING:** The Source Dedicated Server `{server._info["name"] if server._info != {} else "unknown"}` @ `{server.constr}` assigned to this bot is down!\n*You are receiving this message as you are set to be notified regarding server outage at `{guildName}`*
-				''')
+	# Each server is checked on its own schedule, so slow or dead ones never hold up the rest
+	servers = dict(data)
+	health.track(servers.keys())
+	for channelID in health.due():
+		task = asyncio.create_task(probeServer(channelID, servers[channelID]))
+		probes.add(task)
+		task.add_done_callback(probes.discard)
 
-			server.toNotify = validIDs
+	await health.wait()
 
-			server.close()
-			if server.relay:
-				removeConStr(guild, server.constr)
+@bot.loop(600)
+async def persistHistory():
+	await bot.waitUntilReady()
 
-			autoclosed.add(channelID)
-		else:
-			if server.timeSinceDown != -1: server.timeSinceDown = -1
+	try: saveHistory()
+	except OSError as e: print(f"Failed to save history ({e})")
 
-@bot.loop(0.1)
-async def getFromRelay():
-	await bot.waitUntilReady()
-	for channelID, server in data:
-		if server.isClosed or not server.relay: continue
+if config.logIndexInterval:
+	@bot.loop(config.logIndexInterval)
+	async def indexLogs():
+		await bot.waitUntilReady()
 
-		channel = bot.getChannel(channelID)
-		if channel.guild.id not in infoPayloads or server.constr not in infoPayloads[channel.guild.id].constrs: continue
+		logPaths = {server.logPath for _, server in data if server.logPath}
+		try: logSearcher.prune(logPaths)
+		except OSError as e: print(f"Failed to prune log indexes ({e})")
+
+		for logPath in logPaths:
+			try: await logSearcher.index(logPath)
+			except FileNotFoundError: pass # Reported when someone tries to search it
+			except Exception as err: traceback.print_exception(type(err), err, err.__traceback__)
 
-		constring = server.constr
-		msgs = relay.getMessages(constring)
-		for msg in msgs:
-			await channel.send(
-				msg["message"],
+@bot.loop(3600)
+async def logSendStats():
+	await bot.waitUntilReady()
+	if any(stats.sent or stats.shed for stats in scheduler.stats.values()):
+		print(f"Send scheduler: {scheduler.summary()}")
+
+def formatDeath(death: tuple) -> str:
+	if death[3] and not death[4]: # suicide with a weapon
+		return random.choice(config.messageFormats.suicide).format(victim=death[0], inflictor=death[1])
+	elif death[3]: # suicide without a weapon
+		return random.choice(config.messageFormats.suicideNoWeapon).format(victim=death[0])
+	elif not death[4]: # kill with a weapon
+		return random.choice(config.messageFormats.kill).format(victim=death[0], inflictor=death[1], attacker=death[2])
+	else: # kill without a weapon
+		return random.choice(config.messageFormats.killNoWeapon).format(victim=death[0], attacker=death[2])
+
+async def relayToChannel(channelID: str, server: Server) -> bool:
+	'''Sends every event waiting on the relay for a server to its channel, returning False if the channel isn't ready for them'''
+	if server.isClosed or not server.relay: return False
+
+	channel = bot.getChannel(channelID)
+	if channel.guild.id not in infoPayloads or server.constr not in infoPayloads[channel.guild.id].constrs: return False
+
+	constring = server.constr
+	# Priorities are paired with masquerades so packing never merges messages of different priorities
+	outgoing: list[tuple[str, tuple[Masquerade | None, Priority]]] = []
+
+	msgs = relay.getMessages(constring)
+	for msg in msgs:
+		outgoing.append((
+			msg["message"],
+			(
 				Masquerade(
 					f"[{msg['teamName']}] {msg['name']}",
 					msg["icon"],
 					Colour(*[int(val) for val in msg["teamColour"].split(",")])
-				)
+				),
+				Priority.Chat
 			)
+		))
+
+	# Handle custom events
+	custom = relay.getCustom(constring)
+	for body in custom:
+		if len(body) == 0 or body.isspace(): continue
+		outgoing.append((body, (None, Priority.Event)))
+
+	# Handle death events
+	deaths = relay.getDeaths(constring)
+	for death in deaths:
+		outgoing.append((formatDeath(death), (None, Priority.Event)))
 
-		# Handle custom events
-		custom = relay.getCustom(constring)
-		for body in custom:
-			if len(body) == 0 or body.isspace(): continue
-			await channel.send(body)
-
-		# Handle death events
-		deaths = relay.getDeaths(constring)
-		for death in deaths:
-			if death[3] and not death[4]: # suicide with a weapon
-				await channel.send(random.choice(config.messageFormats.suicide).format(victim=death[0], inflictor=death[1]))
-			elif death[3]: # suicide without a weapon
-				await channel.send(random.choice(config.messageFormats.suicideNoWeapon).format(victim=death[0]))
-			elif not death[4]: # kill with a weapon
-				await channel.send(random.choice(config.messageFormats.kill).format(victim=death[0], inflictor=death[1], attacker=death[2]))
-			else: # kill without a weapon
-				await channel.send(random.choice(config.messageFormats.killNoWeapon).format(victim=death[0], attacker=death[2]))
-
-		# Handle join and leave events
-		# (joins first incase someone joins then leaves in the same tenth of a second, so the leave message always comes after the join)
-		joinsAndLeaves = relay.getJoinsAndLeaves(constring)
-
-		for name in joinsAndLeaves[0]:
-			await channel.send(random.choice(config.messageFormats.join).format(player=name))
-		for name in joinsAndLeaves[1]:
-			await channel.send(random.choice(config.messageFormats.leave).format(player=name))
+	# Handle join and leave events
+	# (joins first incase someone joins then leaves in the same batch, so the leave message always comes after the join)
+	joinsAndLeaves = relay.getJoinsAndLeaves(constring)
+
+	for name in joinsAndLeaves[0]:
+		outgoing.append((random.choice(config.messageFormats.join).format(player=name), (None, Priority.Presence)))
+	for name in joinsAndLeaves[1]:
+		outgoing.append((random.choice(config.messageFormats.leave).format(player=name), (None, Priority.Presence)))
+
+	if config.relayBatchWindow > 0:
+		outgoing = packMessages(outgoing)
+
+	for content, (masquerade, priority) in outgoing:
+		scheduler.submit(channel, content, masquerade, priority=priority)
+	return True
+
+@bot.loop(0)
+async def getFromRelay():
+	await bot.waitUntilReady()
+
+	# Sleeps until a client sends something, then only visits the servers that have events waiting
+	constrings = await relay.waitForEvents()
+
+	# Let more events arrive so they can be packed into fewer messages
+	if config.relayBatchWindow > 0:
+		await asyncio.sleep(config.relayBatchWindow)
+
+	for constring in constrings:
+		channels = data.findRelayed(constring)
+
+		# Events are taken by the first channel relaying the server that's ready for them
+		dispatched = False
+		for channelID, server in channels:
+			try: dispatched = await relayToChannel(channelID, server)
+			except Exception as err:
+				traceback.print_exception(type(err), err, err.__traceback__)
+				dispatched = True # Events may have been taken already
+			if dispatched: break
+
+		# None were ready (such as before the guild's info payload is set up), so keep the events and try again shortly
+		if channels and not dispatched:
+			asyncio.get_running_loop().call_later(1, relay.markPending, constring)
 
 @bot.event
 async def onMessage(msg: IMessage):
@@ -740,47 +921,57 @@ async def onMessage(msg: IMessage):
 def updatePayloadConStrs(payload: InfoPayload):
 	'''Goes through every constring using this payload and sends them the new data'''
 	for constr in payload.constrs:
-		relay.setInitPayload(constr, payload.encode())
+		relay.setInitPayload(constr, payload)
+
+	# Encode ahead of time so clients fetching the new data don't have to wait for it
+	if payload.constrs:
+		keepTask(encodes, asyncio.create_task(payload.encodeAsync()))
+
+def flushPayload(guildID: str):
+	if guildID in infoPayloads:
+		updatePayloadConStrs(infoPayloads[guildID])
+
+payloadUpdater = Debouncer(config.infoPayloadDebounce, config.infoPayloadMaxLatency, flushPayload)
 
 @bot.event
 async def onMemberJoin(member: IUser):
 	infoPayloads[member.guild.id].updateMember(member)
-	updatePayloadConStrs(infoPayloads[member.guild.id])
+	if config.infoPayloadMembers: payloadUpdater.trigger(member.guild.id)
 
 @bot.event
 async def onMemberLeave(member: IUser):
 	infoPayloads[member.guild.id].removeMember(member)
-	updatePayloadConStrs(infoPayloads[member.guild.id])
+	if config.infoPayloadMembers: payloadUpdater.trigger(member.guild.id)
 
 @bot.event
 async def onMemberUpdate(member: IUser):
 	infoPayloads[member.guild.id].updateMember(member)
-	updatePayloadConStrs(infoPayloads[member.guild.id])
+	if config.infoPayloadMembers: payloadUpdater.trigger(member.guild.id)
 
 @bot.event
 async def onGuildRoleCreate(role: IRole):
 	infoPayloads[role.guild.id].updateRole(role)
-	updatePayloadConStrs(infoPayloads[role.guild.id])
+	payloadUpdater.trigger(role.guild.id)
 
 @bot.event
 async def onGuildRoleDelete(role: IRole):
 	infoPayloads[role.guild.id].removeRole(role)
-	updatePayloadConStrs(infoPayloads[role.guild.id])
+	payloadUpdater.trigger(role.guild.id)
 
 @bot.event
 async def onGuildRoleUpdate(role: IRole):
 	infoPayloads[role.guild.id].updateRole(role)
-	updatePayloadConStrs(infoPayloads[role.guild.id])
+	payloadUpdater.trigger(role.guild.id)
 
 @bot.event
 async def onGuildEmojiCreate(emoji: IEmoji):
 	infoPayloads[emoji.guild.id].updateEmoji(emoji)
-	updatePayloadConStrs(infoPayloads[emoji.guild.id])
+	payloadUpdater.trigger(emoji.guild.id)
 
 @bot.event
 async def onGuildEmojiDelete(emoji: IEmoji):
 	infoPayloads[emoji.guild.id].removeEmoji(emoji)
-	updatePayloadConStrs(infoPayloads[emoji.guild.id])
+	payloadUpdater.trigger(emoji.guild.id)
 
 @bot.event
 async def onReady() -> None:
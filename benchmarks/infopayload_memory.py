@@ -0,0 +1,90 @@
+'''
+Measures the memory an info payload holds for a guild's members, after setMembers and encode\n
+Compares the current src/infopayload.py against the version at a git revision (such as the one before
+members were moved into slotted records), using tracemalloc. Members have 1-4 of 40 roles.
+
+Run from the repository root: python benchmarks/infopayload_memory.py --baseline REV [--members N ...]
+'''
+import argparse
+import gc
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.config import Backend
+import src.infopayload
+
+class FakeRole:
+	def __init__(self, id: str, name: str):
+		self.id = id
+		self.name = name
+		self.colour = None
+
+class FakeMember:
+	def __init__(self, id: str, roles: list[FakeRole]):
+		self.id = id
+		self.name = f"user{id}"
+		self.displayName = f"Display Name {id}"
+		self.avatar = f"https://cdn.example.com/avatars/{id}/0123456789abcdef0123456789abcdef.png"
+		self.roles = roles
+
+def loadBaseline(revision: str):
+	'''Imports src/infopayload.py as it was at a revision, as a sibling of the current one so its relative imports resolve'''
+	source = subprocess.run(
+		["git", "show", f"{revision}:src/infopayload.py"], cwd=ROOT, capture_output=True, text=True, check=True
+	).stdout
+
+	spec = importlib.util.spec_from_loader("src._baselineinfopayload", loader=None)
+	module = importlib.util.module_from_spec(spec)
+	module.__package__ = "src"
+	exec(compile(source, f"{revision}:src/infopayload.py", "exec"), module.__dict__)
+	return module
+
+def makeMembers(count: int) -> list[FakeMember]:
+	random.seed(0)
+	roles = [FakeRole(str(100000 + i), f"Role {i}") for i in range(40)]
+	# Fresh strings for every member, as a backend would hand them over
+	return [
+		FakeMember(str(10**17 + i), [FakeRole(str(int(role.id)), role.name) for role in random.sample(roles, random.randint(1, 4))])
+		for i in range(count)
+	]
+
+def measure(module, members: list[FakeMember]) -> int:
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+
+	payload = module.InfoPayload(Backend.Discord)
+	payload.setMembers(members)
+	payload.encode()
+
+	gc.collect()
+	used = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+
+	del payload
+	return used
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+	parser.add_argument("--baseline", required=True, help="Revision to compare against, such as a tag or branch")
+	parser.add_argument("--members", type=int, nargs="+", default=[10_000, 100_000])
+	args = parser.parse_args()
+
+	baseline = loadBaseline(args.baseline)
+
+	print(f"{'members':>9} {'baseline':>12} {'current':>12} {'saved':>7}")
+	for count in args.members:
+		members = makeMembers(count)
+		before = measure(baseline, members)
+		after = measure(src.infopayload, members)
+		print(f"{count:>9} {before / 2**20:>8.1f} MiB {after / 2**20:>8.1f} MiB {1 - after / before:>6.1%}")
+
+if __name__ == "__main__":
+	main()
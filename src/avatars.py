@@ -0,0 +1,139 @@
+import asyncio
+from collections import OrderedDict
+import re
+import time
+
+import aiohttp
+
+avatarPattern = re.compile(r"<avatarIcon><!\[CDATA\[(.*?)\]\]></avatarIcon>")
+
+DEFAULT_AVATAR = "http://example.com/"
+
+class AvatarResolver(object):
+	'''
+	Resolves steam avatar URLs in the background so relayed chat never waits on steamcommunity.com\n
+	Results are kept in an LRU cache with a TTL, and failures are cached separately for a shorter time
+	'''
+
+	def __init__(
+		self,
+		baseUrl: str = "http://steamcommunity.com",
+		ttl: float = 86400, negativeTTL: float = 600,
+		maxSize: int = 4096,
+		batchSize: int = 16, batchDelay: float = 0.05,
+		timeout: float = 10
+	):
+		self.baseUrl = baseUrl.rstrip("/")
+		self.ttl = ttl
+		self.negativeTTL = negativeTTL
+		self.maxSize = maxSize
+		self.batchSize = batchSize
+		self.batchDelay = batchDelay
+		self.timeout = timeout
+
+		# steamID -> (expiry, url), where a url of None marks a failed lookup
+		self._cache: OrderedDict[str, tuple[float, str | None]] = OrderedDict()
+		self._inflight: dict[str, asyncio.Future] = {}
+
+		# Insertion ordered set of IDs waiting for the background worker
+		self._pending: dict[str, None] = {}
+		self._wake = asyncio.Event()
+
+		self._session: aiohttp.ClientSession | None = None
+		self._worker: asyncio.Task | None = None
+
+	async def start(self):
+		'''Start the background resolver on the running event loop'''
+		self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+		self._worker = asyncio.create_task(self._work())
+
+	async def stop(self):
+		if self._worker is not None:
+			self._worker.cancel()
+			self._worker = None
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	def _cached(self, steamID: str) -> tuple[bool, str | None]:
+		'''Looks up an ID in the cache, returning (hit, url) and refreshing its LRU position on a hit'''
+		entry = self._cache.get(steamID)
+		if entry is None: return False, None
+
+		if entry[0] < time.monotonic():
+			del self._cache[steamID]
+			return False, None
+
+		self._cache.move_to_end(steamID)
+		return True, entry[1]
+
+	def _store(self, steamID: str, url: str | None):
+		self._cache[steamID] = (time.monotonic() + (self.ttl if url is not None else self.negativeTTL), url)
+		self._cache.move_to_end(steamID)
+		while len(self._cache) > self.maxSize:
+			self._cache.popitem(last=False)
+
+	def get(self, steamID: str) -> str:
+		'''Gets an avatar without waiting, returning the default and queueing a lookup if it isn't cached yet'''
+		hit, url = self._cached(steamID)
+		if hit: return url if url is not None else DEFAULT_AVATAR
+
+		if steamID not in self._inflight and steamID not in self._pending:
+			self._pending[steamID] = None
+			self._wake.set()
+		return DEFAULT_AVATAR
+
+	async def resolve(self, steamID: str) -> str:
+		'''Gets an avatar, sharing a single request between concurrent callers for the same ID'''
+		hit, url = self._cached(steamID)
+		if hit: return url if url is not None else DEFAULT_AVATAR
+
+		if steamID in self._inflight:
+			url = await asyncio.shield(self._inflight[steamID])
+			return url if url is not None else DEFAULT_AVATAR
+
+		future = asyncio.get_running_loop().create_future()
+		self._inflight[steamID] = future
+		try:
+			url = await self._fetch(steamID)
+			self._store(steamID, url)
+			future.set_result(url)
+		except BaseException as e:
+			future.set_exception(e)
+			future.exception() # Mark as retrieved so lone failures don't get logged as unhandled
+			raise
+		finally:
+			del self._inflight[steamID]
+
+		return url if url is not None else DEFAULT_AVATAR
+
+	async def _fetch(self, steamID: str) -> str | None:
+		if self._session is None:
+			raise Exception("Avatar resolver must be started before use")
+
+		try:
+			async with self._session.get(f"{self.baseUrl}/profiles/{steamID}?xml=1") as response:
+				if response.status != 200: return None
+				text = await response.text()
+		except (aiohttp.ClientError, asyncio.TimeoutError):
+			return None
+
+		match = avatarPattern.search(text)
+		return match.group(1) if match is not None else None
+
+	async def _work(self):
+		'''Resolves queued IDs in batches'''
+		while True:
+			await self._wake.wait()
+
+			# Give concurrent chat a moment to queue up so it's resolved in the same batch
+			await asyncio.sleep(self.batchDelay)
+
+			batch = []
+			for steamID in self._pending:
+				batch.append(steamID)
+				if len(batch) == self.batchSize: break
+			for steamID in batch: del self._pending[steamID]
+			if not self._pending: self._wake.clear()
+
+			await asyncio.gather(*[self.resolve(steamID) for steamID in batch], return_exceptions=True)
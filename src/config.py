@@ -1,6 +1,7 @@
 from dataclasses import dataclass, field
 from enum import Enum
 from .utils import Colour
+from .relayqueue import DropPolicy
 
 class Backend(Enum):
 	Undefined = -1,
@@ -21,6 +22,87 @@ class MessageFormats:
 	kill: list[str] = field(default_factory=lambda: ["`{attacker}` killed `{victim}` with `{inflictor}`"])
 	killNoWeapon: list[str] = field(default_factory=lambda: ["`{attacker}` killed `{victim}`"])
 
+DEFAULT_QUEUE_CAPACITIES = {
+	"chat": 200, "rcon": 50,
+	"joins": 100, "leaves": 100, "deaths": 100, "custom": 100
+}
+
+@dataclass
+class QueueConfig:
+	capacity: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_QUEUE_CAPACITIES))
+	policy: DropPolicy = DropPolicy.Oldest
+	ttl: float | None = 300
+
+	@staticmethod
+	def fromJSON(config: dict):
+		capacity = DEFAULT_QUEUE_CAPACITIES | (config["capacity"] if "capacity" in config else {})
+		for kind, size in capacity.items():
+			if size < 1: raise ValueError(f"Relay queue capacity for {kind} must be at least 1")
+
+		return QueueConfig(
+			capacity,
+			DropPolicy(config["policy"]) if "policy" in config else DropPolicy.Oldest,
+			config["ttl"] if "ttl" in config else 300
+		)
+
+@dataclass
+class SchedulerConfig:
+	rate: float = 1
+	burst: int = 5
+	latencyBudget: float = 10
+
+	@staticmethod
+	def fromJSON(config: dict):
+		return SchedulerConfig(
+			config["rate"] if "rate" in config else 1,
+			config["burst"] if "burst" in config else 5,
+			config["latency-budget"] if "latency-budget" in config else 10
+		)
+
+@dataclass
+class QueryCacheConfig:
+	info: float = 5
+	players: float = 5
+	rules: float = 60
+
+	@staticmethod
+	def fromJSON(config: dict):
+		return QueryCacheConfig(
+			config["info"] if "info" in config else 5,
+			config["players"] if "players" in config else 5,
+			config["rules"] if "rules" in config else 60
+		)
+
+@dataclass
+class HealthConfig:
+	interval: float = 60
+	failureInterval: float = 10
+	maxBackoff: float = 900
+	jitter: float = 0.1
+
+	@staticmethod
+	def fromJSON(config: dict):
+		return HealthConfig(
+			config["interval"] if "interval" in config else 60,
+			config["failure-interval"] if "failure-interval" in config else 10,
+			config["max-backoff"] if "max-backoff" in config else 900,
+			config["jitter"] if "jitter" in config else 0.1
+		)
+
+@dataclass
+class NotifierConfig:
+	memberTTL: float = 600
+	concurrency: int = 10
+	maxCachedMembers: int = 4096
+
+	@staticmethod
+	def fromJSON(config: dict):
+		return NotifierConfig(
+			config["member-ttl"] if "member-ttl" in config else 600,
+			config["concurrency"] if "concurrency" in config else 10,
+			config["max-cached-members"] if "max-cached-members" in config else 4096
+		)
+
 @dataclass
 class Config:
 	backend: Backend = Backend.Undefined
@@ -30,6 +112,25 @@ class Config:
 	relayPort: int = 8080
 	messageFormats: MessageFormats = field(default_factory=lambda: MessageFormats())
 	isRunningBehindCloudflare: bool = False
+	relayDnsTTL: float = 300
+	relayMaxLongPoll: float = 30
+	relayQueues: QueueConfig = field(default_factory=lambda: QueueConfig())
+	relayBatchWindow: float = 0
+	sendScheduler: SchedulerConfig = field(default_factory=lambda: SchedulerConfig())
+	infoPayloadDebounce: float = 1
+	infoPayloadMaxLatency: float = 5
+	infoPayloadMembers: bool = True
+	queryTimeout: float = 3
+	queryRetries: int = 2
+	queryCache: QueryCacheConfig = field(default_factory=lambda: QueryCacheConfig())
+	healthCheck: HealthConfig = field(default_factory=lambda: HealthConfig())
+	notifier: NotifierConfig = field(default_factory=lambda: NotifierConfig())
+	restartTimeout: float = 300
+	restartEditInterval: float = 2
+	logSearchWorkers: int | None = None
+	logSearchTimeout: float = 30
+	logIndexInterval: float = 60
+	logFollowInterval: float = 2
 
 	@staticmethod
 	def fromJSON(config: dict):
@@ -43,5 +144,24 @@ class Config:
 				config["message-formats"]["suicide"], config["message-formats"]["suicide-no-weapon"],
 				config["message-formats"]["kill"], config["message-formats"]["kill-no-weapon"]
 			),
-			isRunningBehindCloudflare=config["is-running-behind-cloudflare"]
+			isRunningBehindCloudflare=config["is-running-behind-cloudflare"],
+			relayDnsTTL=config["relay-dns-ttl"] if "relay-dns-ttl" in config else 300,
+			relayMaxLongPoll=config["relay-max-long-poll"] if "relay-max-long-poll" in config else 30,
+			relayQueues=QueueConfig.fromJSON(config["relay-queues"]) if "relay-queues" in config else QueueConfig(),
+			relayBatchWindow=config["relay-batch-window"] if "relay-batch-window" in config else 0,
+			sendScheduler=SchedulerConfig.fromJSON(config["send-scheduler"]) if "send-scheduler" in config else SchedulerConfig(),
+			infoPayloadDebounce=config["info-payload-debounce"] if "info-payload-debounce" in config else 1,
+			infoPayloadMaxLatency=config["info-payload-max-latency"] if "info-payload-max-latency" in config else 5,
+			infoPayloadMembers=config["info-payload-members"] if "info-payload-members" in config else True,
+			queryTimeout=config["query-timeout"] if "query-timeout" in config else 3,
+			queryRetries=config["query-retries"] if "query-retries" in config else 2,
+			queryCache=QueryCacheConfig.fromJSON(config["query-cache"]) if "query-cache" in config else QueryCacheConfig(),
+			healthCheck=HealthConfig.fromJSON(config["health-check"]) if "health-check" in config else HealthConfig(),
+			notifier=NotifierConfig.fromJSON(config["notifier"]) if "notifier" in config else NotifierConfig(),
+			restartTimeout=config["restart-timeout"] if "restart-timeout" in config else 300,
+			restartEditInterval=config["restart-edit-interval"] if "restart-edit-interval" in config else 2,
+			logSearchWorkers=config["log-search-workers"] if "log-search-workers" in config else None,
+			logSearchTimeout=config["log-search-timeout"] if "log-search-timeout" in config else 30,
+			logIndexInterval=config["log-index-interval"] if "log-index-interval" in config else 60,
+			logFollowInterval=config["log-follow-interval"] if "log-follow-interval" in config else 2
 		)
@@ -14,7 +14,7 @@ class Server(SourceServer):
 		self.restartCmd = restartCmd
 		self.logPath = logPath
 
-		self.timeSinceDown: float = -1
+		self.downSince: float | None = None # When the server first failed a health check (monotonic), None while it's up
 
 class Servers:
 	def __init__(self, json: dict) -> None:
@@ -49,6 +49,10 @@ class Servers:
 		if not self.channelBound(channel): raise ValueError("Channel isn't bound")
 		del self._channels[channel.id]
 
+	def findRelayed(self, constr: str) -> list[tuple[str, Server]]:
+		'''Find the channel IDs and servers bound to a constring that have relaying enabled'''
+		return [(id, server) for id, server in self._channels.items() if server.constr == constr and server.relay]
+
 	def __getitem__(self, channel: IChannel) -> Server:
 		if not self.channelBound(channel): raise ValueError("Channel isn't bound")
 		return self._channels[channel.id]
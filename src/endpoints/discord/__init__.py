@@ -84,6 +84,10 @@ class Bot(IBot):
 		async def on_command_error(ctx: commands.Context, err: commands.CommandError):
 			traceback.print_exception(type(err), err, err.__traceback__)
 
+		@bot.event
+		async def on_webhooks_update(channel: discord.abc.GuildChannel):
+			webhookService.invalidate(channel)
+
 		@bot.event
 		async def on_member_join(member: discord.Member):
 			if "onMemberJoin" in self.events:
@@ -131,6 +135,8 @@ class Bot(IBot):
 	async def start(self) -> None:
 		for loop in self.loops:
 			asyncio.create_task(wrapLoop(loop)())
+		for task in self.tasks:
+			asyncio.create_task(task())
 
 		await self._bot.start(self.token)
 
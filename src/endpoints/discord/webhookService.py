@@ -1,28 +1,52 @@
+import asyncio
+
 import discord
 
 _user: discord.ClientUser | None = None
 _avatar: bytes | None = None
 
+# Webhooks by channel ID, and locks so concurrent sends to a channel only create one webhook
+_webhooks: dict[int, discord.Webhook] = {}
+_locks: dict[int, asyncio.Lock] = {}
+
 async def configure(user: discord.ClientUser):
 	global _user, _avatar
 
 	_user = user
 	_avatar = await user.avatar.read()
 
+def invalidate(channel: discord.abc.GuildChannel):
+	'''Forgets the cached webhook for a channel, so the next connect fetches it again'''
+	_webhooks.pop(channel.id, None)
+
 async def connect(channel: discord.TextChannel) -> discord.Webhook:
-	'''Gets a webhook for a channel, creating one if needed. Returns None if forbidden'''
+	'''Gets a webhook for a channel, creating one if needed. Raises discord.Forbidden if forbidden'''
 
 	if _user is None or _avatar is None:
 		raise Exception("Webhook service must be configured before use")
 
-	for webhook in await channel.webhooks():
-		if webhook.user.id != _user.id:
-			continue
+	if channel.id in _webhooks:
+		return _webhooks[channel.id]
 
-		return webhook
+	if channel.id not in _locks:
+		_locks[channel.id] = asyncio.Lock()
 
-	return await channel.create_webhook(
-		name="Masquerades",
-		avatar=_avatar,
-		reason="Create webhook for partial masquerade support"
-	)
+	async with _locks[channel.id]:
+		# Another send may have fetched or created the webhook while we were waiting
+		if channel.id in _webhooks:
+			return _webhooks[channel.id]
+
+		for webhook in await channel.webhooks():
+			if webhook.user.id != _user.id:
+				continue
+
+			_webhooks[channel.id] = webhook
+			return webhook
+
+		webhook = await channel.create_webhook(
+			name="Masquerades",
+			avatar=_avatar,
+			reason="Create webhook for partial masquerade support"
+		)
+		_webhooks[channel.id] = webhook
+		return webhook
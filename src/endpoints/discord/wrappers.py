@@ -99,18 +99,26 @@ class Channel(IChannel):
 				),
 				self.guild
 			)
-		else:
-			return Message(
-				await webhook.send(
-					content,
-					embed=compileEmbed(embed),
-					username=masquerade.name,
-					avatar_url=masquerade.avatar,
-					wait=True,
-					allowed_mentions=discord.AllowedMentions(everyone=False)
-				),
-				self.guild
-			)
+
+		try:
+			return await self._sendWebhook(webhook, content, masquerade, embed)
+		except discord.NotFound:
+			# The cached webhook was deleted, fetch or create a new one and try again
+			webhookService.invalidate(self._chnl)
+			return await self._sendWebhook(await webhookService.connect(self._chnl), content, masquerade, embed)
+
+	async def _sendWebhook(self, webhook: discord.Webhook, content: str | None, masquerade: Masquerade, embed: Embed | None) -> Message:
+		return Message(
+			await webhook.send(
+				content,
+				embed=compileEmbed(embed),
+				username=masquerade.name,
+				avatar_url=masquerade.avatar,
+				wait=True,
+				allowed_mentions=discord.AllowedMentions(everyone=False)
+			),
+			self.guild
+		)
 
 class Role(IRole):
 	_role: discord.Role
@@ -147,6 +155,8 @@ class Guild(IGuild):
 		self._guild = guild
 
 	async def fetchMember(self, id: str) -> IUser | None:
-		member = await self._guild.fetch_member(int(id))
+		try: member = await self._guild.fetch_member(int(id))
+		except discord.NotFound: return None
+
 		if member: return User(member, self)
 		return None
@@ -1,4 +1,5 @@
 import asyncio
+import traceback
 from typing import Callable, Coroutine
 import aiohttp
 
@@ -317,7 +318,11 @@ def wrap(func: Callable) -> Coroutine:
 def wrapLoop(loop):
 	async def wrapper():
 		while True:
-			await loop.func()
+			try:
+				await loop.func()
+			except Exception as err:
+				traceback.print_exception(type(err), err, err.__traceback__)
+
 			await asyncio.sleep(loop.interval)
 	return wrapper
 
@@ -328,6 +333,8 @@ class Bot(IBot):
 	async def start(self) -> None:
 		for loop in self.loops:
 			asyncio.create_task(wrapLoop(loop)())
+		for task in self.tasks:
+			asyncio.create_task(task())
 
 		async with aiohttp.ClientSession() as session:
 			self._bot = BotImpl(self, session, self.token, case_insensitive=True)
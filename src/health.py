@@ -0,0 +1,76 @@
+import asyncio
+from enum import Enum
+import math
+import random
+import time
+from typing import Iterable
+
+from .config import HealthConfig
+
+class Health(Enum):
+	'''Outcome of a health check, which decides when the server is next checked'''
+	Up = 0 # Answered, checked again after the normal interval
+	Failing = 1 # Didn't answer but isn't considered down yet, checked again quickly to confirm
+	Down = 2 # Considered down (or still down), checked again with exponential backoff
+	Idle = 3 # Closed manually, nothing to check until it's reopened
+
+class HealthScheduler(object):
+	'''
+	Tracks when each server is next due a health check\n
+	Healthy servers are checked every interval, failing ones every failure interval until they're up or declared down,
+	and down servers back off exponentially up to a limit. Every delay is jittered so checks don't bunch up
+	'''
+
+	def __init__(self, config: HealthConfig = HealthConfig()):
+		self.config = config
+
+		self._deadlines: dict[str, float] = {}
+		self._downStreaks: dict[str, int] = {}
+		self._rescheduled = asyncio.Event()
+
+	def _jitter(self, delay: float) -> float:
+		return delay * random.uniform(1 - self.config.jitter, 1 + self.config.jitter)
+
+	def track(self, keys: Iterable[str]):
+		'''Sync the tracked servers, new ones are spread across the first interval and missing ones are forgotten'''
+		keys = set(keys)
+		for key in self._deadlines.keys() - keys:
+			del self._deadlines[key]
+			self._downStreaks.pop(key, None)
+
+		now = time.monotonic()
+		for key in keys - self._deadlines.keys():
+			self._deadlines[key] = now + random.uniform(0, self.config.interval)
+
+	def due(self) -> list[str]:
+		'''Take every server due a check, they aren't due again until their result is reported'''
+		now = time.monotonic()
+		keys = [key for key, deadline in self._deadlines.items() if deadline <= now]
+		for key in keys: self._deadlines[key] = math.inf
+		return keys
+
+	def untilNext(self) -> float:
+		'''Time until the next check is due, capped at the interval so new servers are picked up'''
+		if not self._deadlines: return self.config.interval
+		return max(0, min(min(self._deadlines.values()) - time.monotonic(), self.config.interval))
+
+	async def wait(self):
+		'''Waits until the next check is due, or until a reported result may have made one due sooner'''
+		self._rescheduled.clear()
+		try: await asyncio.wait_for(self._rescheduled.wait(), self.untilNext())
+		except asyncio.TimeoutError: pass
+
+	def report(self, key: str, health: Health):
+		'''Schedule a server's next check based on the result of its last one'''
+		if key not in self._deadlines: return
+
+		if health == Health.Down:
+			streak = self._downStreaks.get(key, 0)
+			self._downStreaks[key] = min(streak + 1, 32) # Far past any sensible maximum backoff
+			delay = min(self.config.interval * 2 ** streak, self.config.maxBackoff)
+		else:
+			self._downStreaks.pop(key, None)
+			delay = self.config.failureInterval if health == Health.Failing else self.config.interval
+
+		self._deadlines[key] = time.monotonic() + self._jitter(delay)
+		self._rescheduled.set()
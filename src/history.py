@@ -0,0 +1,174 @@
+from array import array
+from dataclasses import dataclass
+import math
+import os
+import struct
+import sys
+import time
+
+# (bucket size in seconds, number of buckets) for each resolution, covering a day, a month, and a year
+ARCHIVES = ((60, 1440), (3600, 720), (86400, 365))
+
+MAGIC = b"SBH1"
+
+# Longest window any archive covers
+MAX_WINDOW = ARCHIVES[-1][0] * ARCHIVES[-1][1]
+
+class _Archive(object):
+	'''
+	Ring buffer of fixed size buckets for one resolution\n
+	Each slot records the bucket it currently holds, so slots left over from a previous lap are recognised as stale and reused
+	'''
+	__slots__ = ("resolution", "size", "buckets", "samples", "up", "pings", "pingSum", "peakPlayers")
+
+	# Array typecodes of each field, in the order they're persisted
+	FIELDS = (("buckets", "q"), ("samples", "I"), ("up", "I"), ("pings", "I"), ("pingSum", "d"), ("peakPlayers", "H"))
+
+	def __init__(self, resolution: int, size: int):
+		self.resolution = resolution
+		self.size = size
+
+		self.buckets = array("q", [-1]) * size
+		for name, typecode in self.FIELDS[1:]:
+			setattr(self, name, array(typecode, [0]) * size)
+
+	def _slot(self, bucket: int) -> int:
+		'''Gets the slot for a bucket, clearing it if it holds an older one'''
+		slot = bucket % self.size
+		if self.buckets[slot] != bucket:
+			self.buckets[slot] = bucket
+			for name, _ in self.FIELDS[1:]: getattr(self, name)[slot] = 0
+		return slot
+
+	def add(self, timestamp: float, up: bool, ping: float | None, players: int | None):
+		slot = self._slot(int(timestamp // self.resolution))
+
+		self.samples[slot] += 1
+		if up: self.up[slot] += 1
+		if ping is not None:
+			self.pings[slot] += 1
+			self.pingSum[slot] += ping
+		if players is not None:
+			self.peakPlayers[slot] = max(self.peakPlayers[slot], min(players, 65535))
+
+	def slots(self, start: float, end: float):
+		'''Yields the slot of every recorded bucket between two timestamps'''
+		for bucket in range(int(start // self.resolution), int(end // self.resolution) + 1):
+			slot = bucket % self.size
+			if self.buckets[slot] == bucket: yield slot
+
+@dataclass
+class Stats:
+	window: float
+	resolution: int
+	samples: int = 0
+	uptime: float | None = None # Fraction of samples the server was up for
+	pingP50: float | None = None
+	pingP95: float | None = None
+	peakPlayers: int | None = None
+
+def _percentile(values: list[float], fraction: float) -> float:
+	'''Nearest rank percentile of sorted values'''
+	return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class ServerHistory(object):
+	'''Latency, player count and up/down history for one server, downsampled into each resolution as it's recorded'''
+
+	def __init__(self):
+		self.archives = [_Archive(resolution, size) for resolution, size in ARCHIVES]
+
+	def record(self, up: bool, ping: float | None = None, players: int | None = None, timestamp: float | None = None):
+		if timestamp is None: timestamp = time.time()
+		for archive in self.archives: archive.add(timestamp, up, ping, players)
+
+	def stats(self, window: float, now: float | None = None) -> Stats:
+		'''Summarises the history over the last window seconds (up to MAX_WINDOW), using the finest resolution that covers it'''
+		if now is None: now = time.time()
+		window = min(window, MAX_WINDOW) # Nothing older is kept, and each bucket in the window is visited
+		archive = next(
+			(archive for archive in self.archives if archive.resolution * archive.size >= window),
+			self.archives[-1]
+		)
+
+		stats = Stats(window, archive.resolution)
+		up = 0
+		pings = []
+		for slot in archive.slots(now - window, now):
+			stats.samples += archive.samples[slot]
+			up += archive.up[slot]
+			if archive.pings[slot]: pings.append(archive.pingSum[slot] / archive.pings[slot])
+			if archive.up[slot]: stats.peakPlayers = max(stats.peakPlayers or 0, archive.peakPlayers[slot])
+
+		if stats.samples: stats.uptime = up / stats.samples
+		if pings:
+			pings.sort()
+			stats.pingP50 = _percentile(pings, 0.5)
+			stats.pingP95 = _percentile(pings, 0.95)
+		return stats
+
+def _read(f, size: int) -> bytes:
+	'''Reads exactly size bytes, raising ValueError if the file ends first'''
+	data = f.read(size)
+	if len(data) != size: raise ValueError("History file is truncated")
+	return data
+
+class History(object):
+	'''
+	Fixed size history of every server, keyed by constring\n
+	Each server takes the same memory however long the bot has been running for, and the whole history is persisted as raw arrays
+	'''
+
+	def __init__(self):
+		self.servers: dict[str, ServerHistory] = {}
+
+	def __getitem__(self, constr: str) -> ServerHistory:
+		if constr not in self.servers: self.servers[constr] = ServerHistory()
+		return self.servers[constr]
+
+	def prune(self, constrs: set[str]):
+		'''Forget the history of servers that are no longer bound'''
+		for constr in self.servers.keys() - constrs: del self.servers[constr]
+
+	def save(self, path: str):
+		'''Write every server's history to a file, replacing it atomically'''
+		layout = struct.pack("<B", len(ARCHIVES)) + b"".join(struct.pack("<II", *archive) for archive in ARCHIVES)
+
+		with open(path + ".tmp", "wb") as f:
+			f.write(MAGIC + layout + struct.pack("<I", len(self.servers)))
+			for constr, history in self.servers.items():
+				encoded = constr.encode("utf-8")
+				f.write(struct.pack("<H", len(encoded)) + encoded)
+
+				for archive in history.archives:
+					for name, _ in _Archive.FIELDS:
+						values = getattr(archive, name)
+						if sys.byteorder != "little":
+							values = array(values.typecode, values)
+							values.byteswap()
+						values.tofile(f)
+		os.replace(path + ".tmp", path)
+
+	def load(self, path: str):
+		'''Read history saved by save, it's discarded if the resolutions have changed since'''
+		with open(path, "rb") as f:
+			if f.read(4) != MAGIC: raise ValueError("Not a history file")
+
+			count, = struct.unpack("<B", _read(f, 1))
+			layout = tuple(struct.unpack("<II", _read(f, 8)) for _ in range(count))
+			if layout != ARCHIVES: raise ValueError("History was saved with different resolutions")
+
+			servers = {}
+			for _ in range(struct.unpack("<I", _read(f, 4))[0]):
+				length, = struct.unpack("<H", _read(f, 2))
+				constr = _read(f, length).decode("utf-8")
+
+				history = ServerHistory()
+				for archive in history.archives:
+					for name, typecode in _Archive.FIELDS:
+						values = array(typecode)
+						values.fromfile(f, archive.size)
+						if sys.byteorder != "little": values.byteswap()
+						setattr(archive, name, values)
+				servers[constr] = history
+
+		self.servers = servers
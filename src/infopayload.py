@@ -1,64 +1,147 @@
 from .interface import Colour, IUser, IRole, IEmoji
 from .config import Backend
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+import gzip
+import hashlib
 import json
+import sys
+
+# Names of each table in the encoded payload
+MEMBERS = "members"
+ROLES = "roles"
+EMOJIS = "emotes"
+
+class MemberRecord:
+	'''Compact, slotted storage for a member's payload entry'''
+	__slots__ = ("displayName", "username", "avatar", "roles")
+
+	def __init__(self, displayName: str, username: str, avatar: str, roles: tuple[str, ...]):
+		self.displayName = displayName
+		self.username = username
+		self.avatar = avatar
+		self.roles = roles
+
+	def toDict(self) -> dict:
+		return {
+			"display-name": self.displayName,
+			"username": self.username,
+			"avatar": self.avatar,
+			"roles": self.roles
+		}
+
+def _encodeRecord(obj):
+	'''json.dumps hook to encode records as their dict form'''
+	if isinstance(obj, MemberRecord): return obj.toDict()
+	raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 class InfoPayload:
 	'''Represents the payload to be sent on valid PATCH requests'''
-	def __init__(self, backend: Backend):
+
+	# Maximum number of changes kept for delta syncs before older ones are compacted away
+	MAX_LOG_SIZE = 5000
+
+	# Number of entries past which encoding is moved off the event loop by encodeAsync
+	EXECUTOR_THRESHOLD = 5000
+
+	# Most members a single lookup will return for its IDs, and for each of its name prefixes
+	MAX_LOOKUP_IDS = 100
+	MAX_LOOKUP_MATCHES = 25
+
+	def __init__(self, backend: Backend, includeMembers: bool = True):
+		self.includeMembers = includeMembers # Members are only available through lookup when False
+
 		self._dirty = True # Determines if the data has been modified for calls to .encode()
 		self._encoded = "" # Cached encoded data
+		self._etag = "" # Entity tag of the cached encoded data
+		self._compressed: bytes | None = None # Cached gzipped encoded data, compressed on first request
+		self._generation = 0 # Bumped on every modification, so results from the executor can be discarded if stale
+		self._encoding: asyncio.Future | None = None # In progress encodeAsync shared between callers
+
+		# Encoded '"id": {...}' fragment for each entry of each table, in the same order as the table,
+		# and the IDs of entries that have changed since their fragment was encoded (their fragment is None until then)
+		self._fragments: dict[str, dict[str, str | None]] = {MEMBERS: {}, ROLES: {}, EMOJIS: {}}
+		self._stale: dict[str, set[str]] = {MEMBERS: set(), ROLES: set(), EMOJIS: set()}
 
-		self.members: dict[str, dict] = {}
+		# Every change bumps the version, and is logged as (version, table, id, value or None if deleted)
+		self.version = 0
+		self._log: list[tuple[int, str, str, dict | MemberRecord | None]] = []
+		self._logVersions: list[int] = []
+		self._logStart = 0 # Oldest version a delta can be produced from
+
+		self.members: dict[str, MemberRecord] = {}
 		self.roles: dict[str, dict] = {}
 		self.emojis: dict[str, dict] = {}
 
+		# Shared tuples for each distinct set of roles, most members have one of only a few
+		self._roleSets: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+		# Sorted (casefolded name, id) pairs of every display name and username for prefix lookups,
+		# built on first use and kept sorted as members change from then on
+		self._names: list[tuple[str, str]] | None = None
+
 		self.constrs: set[str] = set()
 
 		self.backend: Backend = backend
 
 	def updateMember(self, member: IUser):
 		'''Add or update a member'''
-		self._dirty = True
+		# Strings are kept as given so they're shared with the backend's own cache where possible
+		roles = tuple(sys.intern(role.id) for role in member.roles)
+		if member.id in self.members: self._unindexNames(member.id, self.members[member.id])
+		self.members[member.id] = MemberRecord(
+			member.displayName, member.name, member.avatar,
+			self._roleSets.setdefault(roles, roles)
+		)
+		self._indexNames(member.id, self.members[member.id])
 
-		self.members[member.id] = {
-			"display-name": member.displayName,
-			"username": member.name,
-			"avatar": member.avatar,
-			"roles": [role.id for role in member.roles]
-		}
+		if self.includeMembers:
+			self._dirty = True
+			self._record(MEMBERS, member.id, self.members[member.id])
 
 	def removeMember(self, member: IUser):
 		'''Remove a member from the payload'''
-		self._dirty = True
-		del self.members[member.id]
+		self._unindexNames(member.id, self.members.pop(member.id))
+
+		if self.includeMembers:
+			self._dirty = True
+			self._record(MEMBERS, member.id, None)
 
 	def setMembers(self, members: list[IUser]):
 		'''set the members for the server'''
-		self._dirty = True
-
 		self.members = {}
+		self._names = None
+		if self.includeMembers:
+			self._dirty = True
+			self._clearFragments(MEMBERS)
+
 		for member in members: self.updateMember(member)
+		if self.includeMembers: self._reset()
 
 	def updateRole(self, role: IRole):
 		'''Add or update a role'''
 		self._dirty = True
 
-		self.roles[role.id] = {
-			"name": role.name,
+		self.roles[sys.intern(role.id)] = {
+			"name": sys.intern(role.name),
 			"colour": (role.colour.r, role.colour.g, role.colour.b) if role.colour else (255, 255, 255)
 		}
+		self._record(ROLES, role.id, self.roles[role.id])
 	
 	def removeRole(self, role: IRole):
 		'''Remove a role from the payload'''
 		self._dirty = True
 		del self.roles[role.id]
+		self._record(ROLES, role.id, None)
 	
 	def setRoles(self, roles: list[IRole]):
 		'''set the roles for the server'''
 		self._dirty = True
 
 		self.roles = {}
+		self._clearFragments(ROLES)
 		for role in roles: self.updateRole(role)
+		self._reset()
 
 	def updateEmoji(self, emoji: IEmoji):
 		'''Add or update an emoji'''
@@ -68,18 +151,128 @@ class InfoPayload:
 			"name": emoji.name,
 			"url": emoji.url
 		}
+		self._record(EMOJIS, emoji.id, self.emojis[emoji.id])
 
 	def removeEmoji(self, emoji: IEmoji):
 		'''Remove an emoji'''
 		self._dirty = True
 		del self.emojis[emoji.id]
+		self._record(EMOJIS, emoji.id, None)
 
 	def setEmojis(self, emojis: list[IEmoji]):
 		'''Set the emojis for the server'''
 		self._dirty = True
 
 		self.emojis = {}
+		self._clearFragments(EMOJIS)
 		for emoji in emojis: self.updateEmoji(emoji)
+		self._reset()
+
+	def _tables(self) -> dict[str, dict[str, dict | MemberRecord]]:
+		return {MEMBERS: self.members, ROLES: self.roles, EMOJIS: self.emojis}
+
+	def _clearFragments(self, table: str):
+		self._generation += 1
+		self._fragments[table] = {}
+		self._stale[table] = set()
+
+	def _record(self, table: str, id: str, value: dict | MemberRecord | None):
+		'''Log a change to a table, compacting the log if it's grown too large'''
+		self._generation += 1
+
+		# Reserve the fragment's position so the encoded order matches the table's
+		if value is None:
+			self._fragments[table].pop(id, None)
+			self._stale[table].discard(id)
+		else:
+			if id not in self._fragments[table]: self._fragments[table][id] = None
+			self._stale[table].add(id)
+
+		self.version += 1
+		self._log.append((self.version, table, id, value))
+		self._logVersions.append(self.version)
+
+		if len(self._log) > self.MAX_LOG_SIZE:
+			del self._log[:len(self._log) // 2]
+			del self._logVersions[:len(self._logVersions) // 2]
+			self._logStart = self._logVersions[0] - 1
+
+	def _reset(self):
+		'''Discard the change log after a table has been replaced wholesale, forcing clients to resync'''
+		self._log = []
+		self._logVersions = []
+		self._logStart = self.version
+
+	def delta(self, since: int) -> str | None:
+		'''
+		Encode the changes made after version since as JSON, where deleted entries are null\n
+		Returns None if the changes are no longer available and a full payload must be sent instead
+		'''
+		if since < self._logStart or since > self.version: return None
+
+		tables = {MEMBERS: {}, ROLES: {}, EMOJIS: {}}
+		for _, table, id, value in self._log[bisect_right(self._logVersions, since):]:
+			tables[table][id] = value
+
+		return json.dumps({
+			"backend": self.backend.value,
+			"version": self.version,
+			"delta": True,
+			**tables
+		}, default=_encodeRecord)
+
+	@staticmethod
+	def _namesOf(record: MemberRecord) -> set[str]:
+		return {record.displayName.casefold(), record.username.casefold()}
+
+	def _indexNames(self, id: str, record: MemberRecord):
+		'''Keep the name index sorted as a member is added, rather than rebuilding it (until it's first used there's nothing to keep)'''
+		if self._names is None: return
+		for name in self._namesOf(record): insort(self._names, (name, id))
+
+	def _unindexNames(self, id: str, record: MemberRecord):
+		if self._names is None: return
+		for name in self._namesOf(record):
+			i = bisect_left(self._names, (name, id))
+			if i < len(self._names) and self._names[i] == (name, id): del self._names[i]
+
+	def _nameIndex(self) -> list[tuple[str, str]]:
+		if self._names is None:
+			self._names = sorted((name, id) for id, member in self.members.items() for name in self._namesOf(member))
+		return self._names
+
+	def lookup(self, ids: list[str], prefixes: list[str], limit: int = MAX_LOOKUP_MATCHES) -> str:
+		'''
+		Encode the members with the given IDs, and up to limit members whose display name or username starts with each prefix
+		(ignoring case), along with every role those members have
+		'''
+		limit = max(0, min(limit, self.MAX_LOOKUP_MATCHES))
+		members: dict[str, MemberRecord] = {}
+
+		for id in ids[:self.MAX_LOOKUP_IDS]:
+			if id in self.members: members[id] = self.members[id]
+
+		names = self._nameIndex()
+		for prefix in prefixes[:self.MAX_LOOKUP_IDS]:
+			prefix = prefix.casefold()
+			if not prefix: continue
+
+			matched = set()
+			i = bisect_left(names, (prefix,))
+			while i < len(names) and names[i][0].startswith(prefix) and len(matched) < limit:
+				id = names[i][1]
+				matched.add(id)
+				members[id] = self.members[id]
+				i += 1
+
+		roles = {id: self.roles[id] for member in members.values() for id in member.roles if id in self.roles}
+
+		return json.dumps({
+			"backend": self.backend.value,
+			"version": self.version,
+			MEMBERS: members,
+			ROLES: roles
+		}, default=_encodeRecord)
 
 	def addConStr(self, constr: str):
 		'''Add a connection string that this info payload is being used with'''
@@ -89,14 +282,112 @@ class InfoPayload:
 		'''Remove a connection string that this info payload was being used with'''
 		self.constrs.remove(constr)
 
+	def _takeStale(self) -> list[tuple[str, str, dict | MemberRecord]]:
+		'''Collect the (table, id, value) of every entry whose fragment needs encoding'''
+		tables = self._tables()
+		return [(table, id, tables[table][id]) for table, ids in self._stale.items() for id in ids]
+
+	@staticmethod
+	def _encodeFragments(entries: list[tuple[str, str, dict | MemberRecord]]) -> list[str]:
+		return [f"{json.dumps(id)}: {json.dumps(value, default=_encodeRecord)}" for _, id, value in entries]
+
+	def _applyFragments(self, entries: list[tuple[str, str, dict | MemberRecord]], fragments: list[str]):
+		tables = self._tables()
+		for (table, id, value), fragment in zip(entries, fragments):
+			# Skip entries that were changed or removed while they were being encoded
+			if tables[table].get(id) is not value: continue
+
+			self._fragments[table][id] = fragment
+			self._stale[table].discard(id)
+
+	@staticmethod
+	def _assemble(backend, fragments: dict[str, list[str]]) -> tuple[str, str]:
+		'''Join encoded fragments into the full payload (identical to json.dumps of the tables), returning it and its ETag'''
+		encoded = (
+			f'{{"backend": {json.dumps(backend)}, '
+			f'"{MEMBERS}": {{{", ".join(fragments[MEMBERS])}}}, '
+			f'"{ROLES}": {{{", ".join(fragments[ROLES])}}}, '
+			f'"{EMOJIS}": {{{", ".join(fragments[EMOJIS])}}}}}'
+		)
+		return encoded, f'"{hashlib.sha1(encoded.encode("utf-8")).hexdigest()}"'
+
+	def _snapshotFragments(self) -> dict[str, list[str]]:
+		return {table: list(fragments.values()) for table, fragments in self._fragments.items()}
+
+	def _setEncoded(self, encoded: str, etag: str):
+		self._encoded = encoded
+		self._etag = etag
+		self._compressed = None
+		self._dirty = False
+
 	def encode(self) -> str:
-		'''Encode the payload as JSON (caches the result for later)'''
+		'''Encode the payload as JSON, only re-encoding entries that have changed (caches the result for later)'''
 		if self._dirty:
-			self._encoded = json.dumps({
-				"backend": self.backend.value,
-				"members": self.members,
-				"roles": self.roles,
-				"emotes": self.emojis
-			})
-			self._dirty = False
+			entries = self._takeStale()
+			self._applyFragments(entries, self._encodeFragments(entries))
+			self._setEncoded(*self._assemble(self.backend.value, self._snapshotFragments()))
 		return self._encoded
+
+	async def encodeAsync(self) -> str:
+		'''Encode the payload like encode, but moves the work to an executor for large guilds so the event loop isn't blocked'''
+		if not self._dirty: return self._encoded
+		if self._encoding is not None: return await asyncio.shield(self._encoding)
+
+		loop = asyncio.get_running_loop()
+		self._encoding = loop.create_future()
+		try:
+			while self._dirty:
+				entries = self._takeStale()
+				if len(entries) > self.EXECUTOR_THRESHOLD:
+					fragments = await loop.run_in_executor(None, self._encodeFragments, entries)
+				else:
+					fragments = self._encodeFragments(entries)
+				self._applyFragments(entries, fragments)
+
+				# Entries changed while we were in the executor, encode them before assembling
+				if any(self._stale.values()): continue
+
+				generation = self._generation
+				if sum(len(fragments) for fragments in self._fragments.values()) > self.EXECUTOR_THRESHOLD:
+					result = await loop.run_in_executor(None, self._assemble, self.backend.value, self._snapshotFragments())
+				else:
+					result = self._assemble(self.backend.value, self._snapshotFragments())
+
+				if generation == self._generation: self._setEncoded(*result)
+
+			self._encoding.set_result(self._encoded)
+			return self._encoded
+		except BaseException as e:
+			self._encoding.set_exception(e)
+			self._encoding.exception() # Mark as retrieved so lone failures don't get logged as unhandled
+			raise
+		finally:
+			self._encoding = None
+
+	@property
+	def etag(self) -> str:
+		'''Quoted entity tag for the encoded payload'''
+		self.encode()
+		return self._etag
+
+	def encodeCompressed(self) -> bytes:
+		'''Encode the payload as gzipped JSON (caches the result for later)'''
+		self.encode()
+		if self._compressed is None:
+			self._compressed = gzip.compress(self._encoded.encode("utf-8"))
+		return self._compressed
+
+	async def encodeCompressedAsync(self) -> bytes:
+		'''Encode the payload like encodeCompressed, but compresses large guilds in an executor'''
+		while True:
+			encoded = await self.encodeAsync()
+			if self._compressed is not None: return self._compressed
+
+			if len(self.members) <= self.EXECUTOR_THRESHOLD:
+				return self.encodeCompressed()
+
+			generation = self._generation
+			compressed = await asyncio.get_running_loop().run_in_executor(None, gzip.compress, encoded.encode("utf-8"))
+			if generation == self._generation and not self._dirty:
+				self._compressed = compressed
+				return compressed
@@ -154,6 +154,7 @@ class IBot:
 		self.commands = {}
 		self.events = {}
 		self.loops: list[Loop] = []
+		self.tasks: list[Coroutine] = []
 	
 	async def start(self) -> None:
 		pass
@@ -176,3 +177,7 @@ class IBot:
 		def decorator(func: Coroutine) -> None:
 			self.loops.append(Loop(interval, func))
 		return decorator
+
+	def task(self, func: Coroutine) -> None:
+		'''Registers a coroutine to be run once in the background when the bot starts'''
+		self.tasks.append(func)
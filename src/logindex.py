@@ -0,0 +1,208 @@
+from functools import lru_cache
+import mmap
+import os
+import re
+import struct
+import zlib
+
+MAGIC = b"SBL1"
+
+BLOOM_BITS = 18 # 32KiB per chunk, under 1% of the log with the default chunk size
+HEAD = 4096 # Bytes checksummed at the start of the log and end of the index to recognise rotation and truncation
+
+_HEADER = struct.Struct("<4sQBQQI") # Magic, chunk size, bloom bits, device, inode, head checksum
+_RECORD = struct.Struct("<qI") # Offset of the newline ending the chunk's last line, checksum of the bytes before it, then the bloom filter
+
+_WORD = re.compile(rb"\w{3,}")
+_LITERAL_WORD = re.compile(r"[0-9A-Za-z_]{3,}")
+_LITERAL_WORD_IGNORECASE = re.compile(r"[0-9A-HJL-RT-Za-hjl-rt-z_]{3,}") # I, K and S also match non-ASCII letters when ignoring case
+
+def _bit(trigram: bytes) -> int:
+	return (int.from_bytes(trigram, "little") * 2654435761 & 0xFFFFFFFF) >> (32 - BLOOM_BITS)
+
+def indexChunk(path: str, start: int, end: int, size: int) -> tuple[int, int, bytes] | None:
+	'''
+	Builds the bloom filter of the trigrams in the words of the lines starting within [start, end) of the first size bytes of a file,
+	along with where those lines end and a checksum of the bytes before it, or None if the last line isn't finished yet\n
+	Words are lowercased ASCII runs, so the filter answers for any case. Runs in the worker pool
+	'''
+	with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		stop = mm.find(b"\n", end - 1, size)
+		if stop == -1: return None
+
+		text = mm[start:stop + 1]
+		tail = zlib.crc32(mm[max(0, stop + 1 - HEAD):stop + 1])
+
+	bloom = bytearray(1 << BLOOM_BITS - 3)
+	words = set(_WORD.findall(text.lower()))
+	for trigram in {word[i:i + 3] for word in words for i in range(len(word) - 2)}:
+		bit = _bit(trigram)
+		bloom[bit >> 3] |= 1 << (bit & 7)
+	return stop, tail, bytes(bloom)
+
+def _literals(items, flags: set[int], constants) -> list[list[str]]:
+	'''
+	Finds the literals any match of a parsed pattern must contain, as clauses that must all hold where each is a list of alternatives\n
+	The flags of scoped groups are collected into flags, constants is re's private module of opcodes the pattern was parsed with
+	'''
+	repeats = (constants.MAX_REPEAT, constants.MIN_REPEAT, constants.POSSESSIVE_REPEAT)
+	clauses = []
+	run = []
+
+	def flush():
+		if run: clauses.append(["".join(run)])
+		run.clear()
+
+	for op, av in items:
+		if op is constants.LITERAL: run.append(chr(av))
+		elif op is constants.AT: continue # Zero width, the literals either side are still adjacent
+		else:
+			flush()
+			if op is constants.SUBPATTERN:
+				flags.add(av[1])
+				clauses += _literals(av[-1], flags, constants)
+			elif op in repeats:
+				if av[0] > 0: clauses += _literals(av[2], flags, constants)
+			elif op is constants.ATOMIC_GROUP:
+				clauses += _literals(av, flags, constants)
+			elif op is constants.BRANCH:
+				# Any branch could match, so the best clause of each has to be combined into one
+				options = [_literals(branch, flags, constants) for branch in av[1]]
+				if all(options):
+					clauses.append([
+						literal for option in options
+						for literal in max(option, key=lambda clause: min(len(literal) for literal in clause))
+					])
+	flush()
+	return clauses
+
+def _trigrams(literal: str, ignoreCase: bool) -> tuple[int, ...]:
+	bits = set()
+	for word in (_LITERAL_WORD_IGNORECASE if ignoreCase else _LITERAL_WORD).findall(literal):
+		word = word.lower().encode("ascii")
+		bits.update(_bit(word[i:i + 3]) for i in range(len(word) - 2))
+	return tuple(sorted(bits))
+
+@lru_cache(maxsize=16)
+def requirements(search: str) -> tuple[tuple[tuple[int, ...], ...], ...] | None:
+	'''
+	Works out which bloom filter bits a chunk must have set to possibly match a search, as clauses that must all hold
+	where each is a tuple of alternatives, and an alternative holds if all of its bits are set\n
+	None if nothing can be required, in which case every chunk has to be scanned
+	'''
+	# Relies on the internals of re (as of Python 3.11), so never let a change there break searching, every chunk is scanned instead
+	try:
+		from re import _constants, _parser
+
+		parsed = _parser.parse(search)
+		flags = {parsed.state.flags}
+		clauses = _literals(parsed, flags, _constants)
+		ignoreCase = any(flag & _constants.SRE_FLAG_IGNORECASE for flag in flags)
+	except Exception: return None
+
+	required = []
+	for clause in clauses:
+		alternatives = tuple(_trigrams(literal, ignoreCase) for literal in clause)
+		if all(alternatives): required.append(alternatives) # A literal without trigrams could be anywhere
+	return tuple(required) if required else None
+
+class LogIndex(object):
+	'''
+	Persistent index of a log file, with a bloom filter of the trigrams in each fixed size chunk\n
+	Chunks are only indexed once their last line is finished, after which they never change while the log is appended to.
+	The log's inode and checksums of its start and of the end of the last indexed chunk are kept,
+	so a rotated or truncated log is noticed and indexed afresh\n
+	Loading, checking and extending do file I/O so are run in a thread, while searches read the records on the event loop.
+	Each record is a single tuple (and the record list is only ever appended to or replaced) so both always see whole ones
+	'''
+
+	def __init__(self, path: str, indexPath: str, chunkSize: int):
+		self.path = path
+		self.indexPath = indexPath
+		self.chunkSize = chunkSize
+
+		self.identity: tuple[int, int, int] | None = None # Device, inode and head checksum of the indexed log
+		self.records: list[tuple[int, int, bytes]] = [] # (stop, tail checksum, bloom filter) of each chunk
+
+	def __len__(self) -> int:
+		return len(self.records)
+
+	def load(self):
+		'''Read the index from disk, it's discarded if it was built with different settings'''
+		try:
+			with open(self.indexPath, "rb") as f:
+				header = f.read(_HEADER.size)
+				records = f.read()
+		except FileNotFoundError: return
+		if len(header) < _HEADER.size: return
+
+		magic, chunkSize, bits, device, inode, head = _HEADER.unpack(header)
+		if magic != MAGIC or chunkSize != self.chunkSize or bits != BLOOM_BITS: return
+
+		size = _RECORD.size + (1 << BLOOM_BITS - 3)
+		count = len(records) // size
+		self.identity = (device, inode, head)
+		self.records = [
+			_RECORD.unpack_from(records, i * size) + (records[i * size + _RECORD.size:(i + 1) * size],)
+			for i in range(count)
+		]
+
+		# Drop anything left over from being interrupted mid-write, so appends line up again
+		if len(records) != count * size: os.truncate(self.indexPath, _HEADER.size + count * size)
+
+	def reset(self):
+		self.identity = None
+		self.records = []
+		try: os.remove(self.indexPath)
+		except FileNotFoundError: pass
+
+	def check(self) -> bool:
+		'''Whether the index still describes the log, it's stale if the log has been rotated or truncated since'''
+		identity = self.identity
+		last = self.records[-1] if self.records else None
+		if identity is None: return True
+
+		stat = os.stat(self.path)
+		if (stat.st_dev, stat.st_ino) != identity[:2]: return False
+
+		end = last[0] + 1 if last is not None else 0
+		if stat.st_size < end: return False
+
+		with open(self.path, "rb") as f:
+			if zlib.crc32(f.read(HEAD)) != identity[2]: return False
+			if last is not None:
+				f.seek(max(0, end - HEAD))
+				if zlib.crc32(f.read(end - max(0, end - HEAD))) != last[1]: return False
+		return True
+
+	def pending(self, size: int) -> list[tuple[int, int]]:
+		'''Every full chunk of a log of a size that's yet to be indexed'''
+		return [(start, start + self.chunkSize) for start in range(len(self) * self.chunkSize, size - self.chunkSize + 1, self.chunkSize)]
+
+	def extend(self, records: list[tuple[int, int, bytes]]):
+		'''Append the records of the next chunks, starting the index if it's empty'''
+		if not records: return
+
+		if self.identity is None:
+			stat = os.stat(self.path)
+			with open(self.path, "rb") as f: head = zlib.crc32(f.read(HEAD))
+			self.identity = (stat.st_dev, stat.st_ino, head)
+
+			os.makedirs(os.path.dirname(self.indexPath) or ".", exist_ok=True)
+			with open(self.indexPath, "wb") as f:
+				f.write(_HEADER.pack(MAGIC, self.chunkSize, BLOOM_BITS, *self.identity))
+
+		with open(self.indexPath, "ab") as f:
+			for record in records:
+				f.write(_RECORD.pack(*record[:2]) + record[2])
+				self.records.append(record)
+
+	def mayMatch(self, chunk: int, required: tuple[tuple[tuple[int, ...], ...], ...]) -> bool:
+		'''Whether a chunk could contain a match, which is always the case for chunks that aren't indexed yet'''
+		if chunk >= len(self): return True
+
+		bloom = self.records[chunk][2]
+		return all(
+			any(all(bloom[bit >> 3] >> (bit & 7) & 1 for bit in bits) for bits in alternatives)
+			for alternatives in required
+		)
@@ -0,0 +1,276 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import lru_cache
+import hashlib
+import mmap
+import multiprocessing
+import os
+import re
+import signal
+
+from .logindex import LogIndex, indexChunk, requirements
+
+IP_PATTERN = re.compile(r"(?:(?:[0-9]|[0-9][0-9]|1[0-9][0-9]|2[0-4][0-9]|25[0-5])\.){3}(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[0-9][0-9]|[0-9])")
+REDACTED_IP = "\033[0;31m███.███.███.███\033[0m"
+
+@dataclass
+class SearchResult:
+	lines: list[str] # Oldest first
+	timedOut: bool = False
+
+@lru_cache(maxsize=16)
+def _compile(search: str) -> tuple[re.Pattern, re.Pattern | None]:
+	'''
+	Compiles a search once per process, returning the pattern for lines and one for prefiltering whole chunks\n
+	Lines are matched after their IPs are redacted, so the prefilter is disabled if the pattern could match the redaction itself
+	'''
+	pattern = re.compile(search)
+	if pattern.search(REDACTED_IP) or "\\A" in search or "\\Z" in search: return pattern, None
+	return pattern, re.compile(search, re.MULTILINE)
+
+def _highlight(match: re.Match) -> str:
+	return "\033[1;32m" + match.group() + "\033[0m"
+
+def filterLine(line: str, pattern: re.Pattern | None) -> str | None:
+	'''Redacts the IPs in a line and highlights where it matches a pattern, or returns None if it doesn't match'''
+	line = IP_PATTERN.sub(REDACTED_IP, line)
+	if pattern is None: return line
+
+	line, matches = pattern.subn(_highlight, line)
+	return line if matches else None
+
+def _scanChunk(path: str, start: int, end: int, size: int, search: str, budget: int) -> list[str]:
+	'''
+	Searches the lines starting within [start, end) of the first size bytes of a file, returning the matches newest first
+	(with IPs redacted and matches highlighted), stopping once they fill the budget\n
+	Runs in the worker pool, so it opens its own map of the file
+	'''
+	with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		# Lines belong to the chunk they start in
+		if start > 0:
+			newline = mm.find(b"\n", start - 1, end - 1)
+			if newline == -1: return []
+			start = newline + 1
+
+		stop = mm.find(b"\n", end - 1, size)
+		if stop == -1: stop = size
+		text = mm[start:stop].decode("utf-8", errors="replace")
+
+	# Strip the carriage returns of CRLF line endings up front, so the prefilter sees the same lines as the search (such as for $)
+	if "\r" in text: text = text.replace("\r\n", "\n").removesuffix("\r")
+
+	pattern, prefilter = _compile(search) if search else (None, None)
+	if prefilter is not None and prefilter.search(text) is None: return []
+
+	lines = text.split("\n")
+
+	matched = []
+	total = 0
+	for line in reversed(lines):
+		# Only lines that match are worth redacting, but they're matched again after as the redaction may change the result
+		if prefilter is not None and pattern.search(line) is None: continue
+
+		line = filterLine(line, pattern)
+		if line is None: continue
+
+		matched.append(line)
+		total += len(line) + 1
+		if total > budget: break
+	return matched
+
+def _filterLines(lines: list[bytes], search: str) -> list[str]:
+	'''Decodes lines and filters them like a search does, keeping their order. Runs in the worker pool'''
+	pattern = _compile(search)[0] if search else None
+
+	filtered = []
+	for line in lines:
+		line = filterLine(line.decode("utf-8", errors="replace").removesuffix("\r"), pattern)
+		if line is not None: filtered.append(line)
+	return filtered
+
+def _initWorker():
+	# Forked workers inherit the bot's shutdown handlers, which would save its stale copy of the data over the real one.
+	# Interrupts are left to the bot, which shuts the pool down, and termination just ends the worker
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _makePool(workers: int | None) -> Executor:
+	# Forking is required, spawned workers would re-run the bot's entry point as they don't have a main guard
+	if "fork" in multiprocessing.get_all_start_methods():
+		return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"), initializer=_initWorker)
+	return ThreadPoolExecutor(workers)
+
+class LogSearcher(object):
+	'''
+	Searches log files from the end for the latest lines matching a regex, without blocking the event loop\n
+	The file is split into fixed size chunks which are scanned newest first in a pool of worker processes,
+	a few chunks ahead of the results being collected, and scanning stops as soon as enough lines have been found.
+	Logs can also be indexed in indexDir, letting searches skip the chunks that can't contain a match
+	'''
+
+	def __init__(
+		self, workers: int | None = None, timeout: float = 30, chunkSize: int = 4 * 1024 * 1024, budget: int = 1000,
+		indexDir: str | None = None
+	):
+		self.workers = workers if workers else os.cpu_count() or 1
+		self.timeout = timeout
+		self.chunkSize = chunkSize
+		self.budget = budget
+		self.indexDir = indexDir
+
+		self._pool: Executor | None = None
+		self._indexes: dict[str, asyncio.Task[LogIndex]] = {} # Loaded (or loading) index of each log
+
+	def close(self):
+		'''
+		Kills the workers, a new pool is started when next needed. Used after a timeout so work that's still running
+		(such as a catastrophic regex) doesn't keep hold of them, anything else using the old pool fails with BrokenProcessPool
+		'''
+		pool, self._pool = self._pool, None
+		if pool is None: return
+
+		# Threads can't be killed, they're left to finish on their own
+		for process in list((getattr(pool, "_processes", None) or {}).values()): process.terminate()
+		pool.shutdown(wait=False) # Killing the workers fails everything queued with BrokenProcessPool
+
+	def _executor(self) -> Executor:
+		if self._pool is None: self._pool = _makePool(self.workers)
+		return self._pool
+
+	def _indexPath(self, path: str) -> str:
+		name = hashlib.sha1(os.path.abspath(path).encode("utf-8", errors="surrogateescape")).hexdigest()[:16]
+		return os.path.join(self.indexDir, name + ".idx")
+
+	async def _index(self, path: str) -> LogIndex:
+		'''Gets the index of a log, loading it from disk in a thread on first use (shared between concurrent callers)'''
+		if path not in self._indexes:
+			async def load() -> LogIndex:
+				index = LogIndex(path, self._indexPath(path), self.chunkSize)
+				await asyncio.to_thread(index.load)
+				return index
+
+			self._indexes[path] = asyncio.create_task(load())
+
+		task = self._indexes[path]
+		try: return await asyncio.shield(task)
+		except Exception:
+			if self._indexes.get(path) is task: del self._indexes[path] # Try again next time
+			raise
+
+	async def index(self, path: str):
+		'''
+		Brings the index of a log file up to date, indexing the chunks finished since it was last updated in the worker pool\n
+		Raises OSError if the file can't be read
+		'''
+		index = await self._index(path)
+		if not await asyncio.to_thread(index.check): await asyncio.to_thread(index.reset)
+
+		size = os.path.getsize(path)
+		pending = index.pending(size)
+		if not pending: return
+
+		loop = asyncio.get_running_loop()
+		for i in range(0, len(pending), self.workers):
+			executor = self._executor()
+			try:
+				records = await asyncio.gather(*[
+					loop.run_in_executor(executor, indexChunk, path, start, end, size)
+					for start, end in pending[i:i + self.workers]
+				])
+			except BrokenProcessPool: return # Recycled after a search timed out, carried on next time
+
+			# The log may have been rotated while it was being read, it'll be indexed afresh next time
+			if not await asyncio.to_thread(index.check): return
+
+			finished = records.index(None) if None in records else len(records)
+			await asyncio.to_thread(index.extend, records[:finished])
+			if finished < len(records): return
+
+	def prune(self, paths: set[str]):
+		'''Forget the indexes of logs that are no longer configured'''
+		for path in self._indexes.keys() - paths: del self._indexes[path]
+		if self.indexDir is None or not os.path.isdir(self.indexDir): return
+
+		keep = {os.path.basename(self._indexPath(path)) for path in paths}
+		for name in os.listdir(self.indexDir):
+			if name.endswith(".idx") and name not in keep: os.remove(os.path.join(self.indexDir, name))
+
+	async def filterLines(self, lines: list[bytes], search: str = "", timeout: float | None = None) -> list[str] | None:
+		'''
+		Filters lines as they'd be found by a search (with IPs redacted and matches highlighted) in the worker pool,
+		or returns None if that takes longer than the timeout (the searcher's by default), in which case the pool is recycled
+		'''
+		if not lines: return []
+
+		loop = asyncio.get_running_loop()
+		for retry in (True, False):
+			executor = self._executor()
+			try: return await asyncio.wait_for(loop.run_in_executor(executor, _filterLines, lines, search), self.timeout if timeout is None else timeout)
+			except asyncio.TimeoutError:
+				if self._pool is executor: self.close()
+				return None
+			except BrokenProcessPool:
+				if not retry: raise # Recycled after a search timed out while this was queued, so it's tried once more
+
+	async def search(self, path: str, search: str = "") -> SearchResult:
+		'''
+		Finds the latest lines of a file matching a regex (or the latest lines if there's no regex) that fit in the budget\n
+		Raises re.error if the regex is invalid, and OSError if the file can't be read
+		'''
+		if search: re.compile(search)
+
+		size = os.path.getsize(path)
+		if size == 0: return SearchResult([])
+
+		loop = asyncio.get_running_loop()
+		chunks = [(start, min(start + self.chunkSize, size)) for start in range(0, size, self.chunkSize)]
+
+		# The index only rules out chunks the prefilter would have found nothing in, so it's unusable without one
+		if search and self.indexDir is not None and _compile(search)[1] is not None:
+			required = requirements(search)
+			index = await self._index(path) if required is not None else None
+			if index is not None and await asyncio.to_thread(index.check):
+				chunks = [chunk for chunk in chunks if index.mayMatch(chunk[0] // self.chunkSize, required)]
+				if not chunks: return SearchResult([])
+
+		chunks.reverse()
+
+		# Even small files are searched in the pool, as only a worker process can be stopped if the search runs away
+		executor = self._executor()
+
+		def submit(chunk: tuple[int, int]) -> asyncio.Future:
+			return loop.run_in_executor(executor, _scanChunk, path, chunk[0], chunk[1], size, search, self.budget)
+
+		deadline = loop.time() + self.timeout
+		pending = [submit(chunk) for chunk in chunks[:self.workers * 2]]
+		queued = iter(chunks[self.workers * 2:])
+
+		matched = []
+		total = 0
+		try:
+			while pending:
+				future = pending.pop(0)
+				try: lines = await asyncio.wait_for(asyncio.shield(future), max(0, deadline - loop.time()))
+				except asyncio.TimeoutError:
+					future.cancel()
+					if self._pool is executor: self.close()
+
+					matched.reverse()
+					return SearchResult(matched, True)
+
+				chunk = next(queued, None)
+				if chunk is not None: pending.append(submit(chunk))
+
+				for line in lines:
+					matched.append(line)
+					total += len(line) + 1
+					if total > self.budget:
+						matched.reverse()
+						return SearchResult(matched)
+		finally:
+			for future in pending: future.cancel()
+
+		matched.reverse()
+		return SearchResult(matched)
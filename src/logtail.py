@@ -0,0 +1,173 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import os
+import re
+import traceback
+from typing import BinaryIO
+
+from .interface import IChannel
+from .logsearch import LogSearcher
+from .scheduler import Priority, SendScheduler
+from .utils import packMessages
+
+class LogFollower(object):
+	'''
+	Follows a log file into a channel like tail -f, posting new lines that match a regex in batches through the send scheduler\n
+	Only what's been appended since the last read is read, from the stored offset. Rotation (the path being replaced) and truncation
+	are followed, and memory stays constant: at most MAX_READ bytes are read per interval and only as many messages posted
+	as the channel's send rate allows, so a log written faster than it can be posted is skipped ahead rather than buffered.
+	Lines are filtered in the log searcher's worker pool, and following stops if a batch takes longer than FILTER_TIMEOUT
+	'''
+
+	MAX_READ = 256 * 1024
+	MAX_LINE = 1900 # Longest line held on to while it's being written, longer lines are cut
+	FILTER_TIMEOUT = 5
+
+	WRAPPER = "```ansi\n{}\n```"
+
+	def __init__(self, scheduler: SendScheduler, searcher: LogSearcher, channel: IChannel, path: str, search: str = "", interval: float = 2):
+		'''Raises re.error if the regex is invalid'''
+		if search: re.compile(search)
+
+		self.scheduler = scheduler
+		self.searcher = searcher
+		self.channel = channel
+		self.path = path
+		self.search = search
+		self.interval = interval
+
+		self._file: BinaryIO | None = None
+		self._offset = 0
+		self._partial = b"" # Start of the line being written
+		self._midLine = False # Whether the start of the current line was skipped
+		self._task: asyncio.Task | None = None
+
+	@property
+	def running(self) -> bool:
+		return self._task is not None and not self._task.done()
+
+	@property
+	def maxMessages(self) -> int:
+		'''Messages posted per interval, as many as the scheduler lets through to a channel in that time'''
+		return max(1, int(self.scheduler.config.rate * self.interval))
+
+	async def start(self):
+		'''Starts following from the current end of the file, raises OSError if it can't be opened'''
+		await asyncio.to_thread(self._open, True)
+		self._task = asyncio.create_task(self._follow())
+
+	def stop(self):
+		if self._task is not None: self._task.cancel()
+
+	def _open(self, atEnd: bool = False):
+		self._file = open(self.path, "rb")
+		self._offset = self._file.seek(0, os.SEEK_END) if atEnd else 0
+
+	def _close(self):
+		if self._file is not None: self._file.close()
+		self._file = None
+
+	def _take(self) -> tuple[bytes, int]:
+		'''Reads what's been appended to the open file since the last read, returning it along with how many bytes were skipped'''
+		size = os.fstat(self._file.fileno()).st_size
+		skipped = max(0, size - self._offset - self.MAX_READ)
+		self._offset += skipped
+
+		self._file.seek(self._offset)
+		data = self._file.read(size - self._offset)
+		self._offset += len(data)
+		return data, skipped
+
+	def _split(self, data: bytes, skipped: int, finished: bool = False) -> list[bytes]:
+		'''Splits read data into lines, holding on to the unfinished one unless the file it's from is finished with'''
+		if skipped:
+			self._partial = b""
+			self._midLine = True
+
+		lines = (self._partial + data).split(b"\n")
+		self._partial = lines.pop()
+		if self._midLine and lines:
+			lines.pop(0)
+			self._midLine = False
+
+		if finished:
+			# Whatever's left is the last line of the file, the next one starts afresh
+			if self._partial and not self._midLine: lines.append(self._partial)
+			self._partial = b""
+			self._midLine = False
+		elif self._midLine: self._partial = b""
+
+		# Cut off lines that go on for too long, the rest of them is dropped
+		if len(self._partial) > self.MAX_LINE:
+			lines.append(self._partial)
+			self._partial = b""
+			self._midLine = True
+		return lines
+
+	def _read(self) -> tuple[list[bytes], int]:
+		'''Reads the lines finished since the last read and how many bytes were skipped, following rotation and truncation'''
+		if self._file is None:
+			# Reopen after a rotation where the new file didn't exist yet
+			try: self._open()
+			except FileNotFoundError: return [], 0
+
+		lines = []
+		skipped = 0
+		try: replaced = not os.path.samestat(os.stat(self.path), os.fstat(self._file.fileno()))
+		except FileNotFoundError: replaced = True
+
+		if replaced:
+			# Rotated, finish off the old file before moving on to the new one
+			data, skipped = self._take()
+			lines = self._split(data, skipped, True)
+			self._close()
+			try: self._open()
+			except FileNotFoundError: return lines, skipped
+		elif os.fstat(self._file.fileno()).st_size < self._offset:
+			# Truncated, start again from the beginning
+			lines = self._split(b"", 0, True)
+			self._offset = 0
+
+		data, newlySkipped = self._take()
+		return lines + self._split(data, newlySkipped), skipped + newlySkipped
+
+	def _post(self, lines: list[str], skipped: int, lost: int = 0):
+		limit = 2000 - len(self.WRAPPER.format(""))
+
+		# Redaction and highlighting can push a line over
+		messages = [self.WRAPPER.format(content) for content, _ in packMessages([(line[:limit], None) for line in lines], limit)]
+
+		dropped = len(messages) - self.maxMessages
+		if dropped > 0: messages = messages[dropped:] # Keep the latest
+
+		notes = []
+		if skipped: notes.append(f"{skipped} bytes")
+		if lost: notes.append(f"{lost} lines")
+		if dropped > 0: notes.append(f"{dropped} messages")
+		if notes: self.scheduler.submit(self.channel, f"*Skipped {' and '.join(notes)} to keep up with the log*", priority=Priority.Log)
+		for message in messages:
+			self.scheduler.submit(self.channel, message, priority=Priority.Log)
+
+	async def _follow(self):
+		try:
+			while True:
+				await asyncio.sleep(self.interval)
+
+				try: lines, skipped = await asyncio.to_thread(self._read)
+				except OSError as err:
+					traceback.print_exception(type(err), err, err.__traceback__)
+					self.scheduler.submit(self.channel, "Stopped following the log file as it couldn't be read", priority=Priority.Log)
+					return
+
+				try: filtered = await self.searcher.filterLines(lines, self.search, self.FILTER_TIMEOUT)
+				except BrokenProcessPool:
+					self._post([], skipped, len(lines))
+					continue
+
+				if filtered is None:
+					self.scheduler.submit(self.channel, "Stopped following the log file as the search took too long", priority=Priority.Log)
+					return
+
+				self._post(filtered, skipped)
+		finally:
+			self._close()
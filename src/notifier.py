@@ -0,0 +1,110 @@
+import asyncio
+from collections import OrderedDict
+import time
+import traceback
+
+from .config import NotifierConfig
+from .data import Server
+from .interface import IGuild, IUser
+from .scheduler import Priority, SendScheduler
+
+class Notifier(object):
+	'''
+	Sends outage DMs to everyone subscribed to a server in the background, so health checks never wait on them\n
+	Members are resolved through a TTL cache that falls back to the backend, sends run concurrently up to a limit,
+	and the IDs of members who have left are pruned from the server in one go once everyone's been resolved
+	'''
+
+	def __init__(self, scheduler: SendScheduler, config: NotifierConfig = NotifierConfig()):
+		self.scheduler = scheduler
+		self.config = config
+
+		# (guild ID, member ID) -> (expiry, member), where a member of None marks someone who isn't in the guild
+		self._members: OrderedDict[tuple[str, str], tuple[float, IUser | None]] = OrderedDict()
+		self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+		self._semaphore = asyncio.Semaphore(config.concurrency)
+		self._tasks: set[asyncio.Task] = set()
+
+	def _store(self, key: tuple[str, str], member: IUser | None):
+		self._members[key] = (time.monotonic() + self.config.memberTTL, member)
+		self._members.move_to_end(key)
+		while len(self._members) > self.config.maxCachedMembers:
+			self._members.popitem(last=False)
+
+	async def member(self, guild: IGuild, id: str) -> IUser | None:
+		'''Gets a member of a guild, or None if they aren't in it, sharing a single lookup between concurrent callers'''
+		key = (guild.id, id)
+		entry = self._members.get(key)
+		if entry is not None and entry[0] >= time.monotonic():
+			self._members.move_to_end(key)
+			return entry[1]
+
+		if key in self._inflight: return await asyncio.shield(self._inflight[key])
+
+		future = asyncio.get_running_loop().create_future()
+		self._inflight[key] = future
+		try:
+			member = await guild.fetchMember(id)
+			self._store(key, member)
+			future.set_result(member)
+		except BaseException as e:
+			future.set_exception(e)
+			future.exception() # Mark as retrieved so lone failures don't get logged as unhandled
+			raise
+		finally:
+			del self._inflight[key]
+
+		return member
+
+	async def members(self, guild: IGuild, ids: list[str]) -> dict[str, IUser | None]:
+		'''
+		Resolves many members of a guild concurrently (up to the concurrency limit)\n
+		Members that couldn't be looked up (rather than aren't in the guild) are left out
+		'''
+		async def resolve(id: str) -> IUser | None:
+			async with self._semaphore:
+				return await self.member(guild, id)
+
+		results = await asyncio.gather(*[resolve(id) for id in ids], return_exceptions=True)
+
+		resolved = {}
+		for id, result in zip(ids, results):
+			if isinstance(result, Exception):
+				traceback.print_exception(type(result), result, result.__traceback__)
+			else:
+				resolved[id] = result
+		return resolved
+
+	@staticmethod
+	def prune(server: Server, resolved: dict[str, IUser | None]):
+		'''Remove everyone that was found not to be in the guild from a server's notify list'''
+		invalid = {id for id, member in resolved.items() if member is None}
+		if invalid: server.toNotify = [id for id in server.toNotify if id not in invalid]
+
+	def notify(self, guild: IGuild, server: Server, content: str):
+		'''Queue a DM to everyone subscribed to a server without waiting for them to be sent'''
+		task = asyncio.create_task(self._notify(guild, server, content))
+		self._tasks.add(task)
+		task.add_done_callback(self._tasks.discard)
+
+	async def _notify(self, guild: IGuild, server: Server, content: str):
+		async def send(id: str) -> IUser | None:
+			async with self._semaphore:
+				member = await self.member(guild, id)
+				if member is None: return None
+
+				try: await self.scheduler.send(member, content, priority=Priority.Outage)
+				except Exception as err: traceback.print_exception(type(err), err, err.__traceback__)
+				return member
+
+		ids = list(server.toNotify)
+		results = await asyncio.gather(*[send(id) for id in ids], return_exceptions=True)
+
+		resolved = {}
+		for id, result in zip(ids, results):
+			if isinstance(result, Exception):
+				traceback.print_exception(type(result), result, result.__traceback__)
+			else:
+				resolved[id] = result
+		self.prune(server, resolved)
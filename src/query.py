@@ -0,0 +1,387 @@
+import asyncio
+import bz2
+import ipaddress
+import socket
+import struct
+import time
+from typing import Awaitable, Callable
+import weakref
+import zlib
+
+from sourceserver.exceptions import SourceError
+
+from .config import QueryCacheConfig
+from .data import Server
+
+INFO_REQUEST = b"\xFF\xFF\xFF\xFFTSource Engine Query\x00"
+PLAYERS_REQUEST = b"\xFF\xFF\xFF\xFF\x55"
+RULES_REQUEST = b"\xFF\xFF\xFF\xFF\x56"
+NO_CHALLENGE = b"\xFF\xFF\xFF\xFF"
+
+SINGLE_HEADER = -1
+SPLIT_HEADER = -2
+
+CHALLENGE = 0x41
+INFO = 0x49
+PLAYERS = 0x44
+RULES = 0x45
+
+# Games whose split packets don't include the size field (see https://developer.valvesoftware.com/wiki/Server_queries#Multi-packet_Response_Format)
+NO_SIZE_IDS = (215, 17550, 17700, 240)
+
+class QueryError(SourceError):
+	'''SourceError raised by the query engine, which has no per server socket to close'''
+	def __init__(self, server: Server, message: str):
+		self.message = "Source Server Error @ " + server._hostname + ":" + str(server._port) + " | " + message
+		Exception.__init__(self, self.message)
+
+class _Reader(object):
+	'''Reads little endian fields from a response, raising QueryError if it runs off the end'''
+
+	def __init__(self, server: Server, data: bytes):
+		self.server = server
+		self.data = data
+		self.pos = 0
+
+	@property
+	def atEnd(self) -> bool:
+		return self.pos >= len(self.data)
+
+	def _unpack(self, fmt: str):
+		try: value, = struct.unpack_from(fmt, self.data, self.pos)
+		except struct.error: raise QueryError(self.server, "Response ended unexpectedly")
+		self.pos += struct.calcsize(fmt)
+		return value
+
+	def byte(self) -> int | None:
+		'''Reads a byte, or None if there are none left (matching sourceserver's optional fields)'''
+		if self.atEnd: return None
+		self.pos += 1
+		return self.data[self.pos - 1]
+
+	def short(self) -> int: return self._unpack("<h")
+	def long(self) -> int: return self._unpack("<l")
+	def longlong(self) -> int: return self._unpack("<Q")
+	def float(self) -> float: return self._unpack("<f")
+
+	def string(self) -> str:
+		end = self.data.find(b"\x00", self.pos)
+		if end == -1: raise QueryError(self.server, "A string ran off the end of the response")
+
+		value = self.data[self.pos:end].decode("utf-8", errors="replace")
+		self.pos = end + 1
+		return value
+
+class _Protocol(asyncio.DatagramProtocol):
+	def __init__(self, engine: "QueryEngine"):
+		self.engine = engine
+
+	def datagram_received(self, data: bytes, addr: tuple):
+		self.engine._received(data, addr[:2])
+
+	def error_received(self, exc: Exception):
+		pass # ICMP errors from dead servers, their requests will time out
+
+	def connection_lost(self, exc: Exception | None):
+		self.engine._transport = None
+
+class QueryEngine(object):
+	'''
+	Asynchronous A2S query client, multiplexing requests to every server over one UDP socket\n
+	A2S responses carry no request ID, so only one request per server address is in flight at a time,
+	but any number of servers can be queried concurrently. Results take the same form as sourceserver's\n
+	Results are cached per server for a configurable time per query type, and concurrent callers share a single query
+	'''
+
+	# Most challenge responses to follow for a single request before giving up
+	CHALLENGE_RETRIES = 10
+
+	def __init__(self, timeout: float = 3, retries: int = 2, cacheConfig: QueryCacheConfig = QueryCacheConfig()):
+		self.timeout = timeout
+		self.retries = retries
+		self.cacheConfig = cacheConfig
+
+		# (constring, query type) -> (expiry, result), and the queries currently being made
+		self._cache: dict[tuple[str, str], tuple[float, object]] = {}
+		self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+
+		self._transport: asyncio.DatagramTransport | None = None
+		self._opening = asyncio.Lock()
+
+		# Datagrams from each server address are routed to the queue of the request waiting on it
+		self._waiting: dict[tuple[str, int], asyncio.Queue[bytes]] = {}
+		self._locks: weakref.WeakValueDictionary[tuple[str, int], asyncio.Lock] = weakref.WeakValueDictionary()
+
+	async def _open(self) -> asyncio.DatagramTransport:
+		'''Gets the shared socket, opening it on first use'''
+		async with self._opening:
+			if self._transport is None or self._transport.is_closing():
+				self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+					lambda: _Protocol(self), local_addr=("0.0.0.0", 0), family=socket.AF_INET
+				)
+		return self._transport
+
+	def close(self):
+		if self._transport is not None:
+			self._transport.close()
+			self._transport = None
+
+	def _received(self, data: bytes, addr: tuple[str, int]):
+		queue = self._waiting.get(addr)
+		if queue is not None: queue.put_nowait(data)
+
+	async def _resolve(self, server: Server) -> tuple[str, int]:
+		try:
+			ipaddress.IPv4Address(server._hostname)
+			return server._hostname, server._port
+		except ValueError: pass
+
+		try:
+			addresses = await asyncio.get_running_loop().getaddrinfo(
+				server._hostname, server._port,
+				family=socket.AF_INET, type=socket.SOCK_DGRAM
+			)
+		except socket.gaierror: raise QueryError(server, "Failed to resolve hostname")
+		if not addresses: raise QueryError(server, "Failed to resolve hostname")
+
+		return addresses[0][4][:2]
+
+	async def _packet(self, queue: asyncio.Queue[bytes]) -> bytes | None:
+		try: return await asyncio.wait_for(queue.get(), self.timeout)
+		except asyncio.TimeoutError: return None
+
+	async def _exchange(
+		self, server: Server, transport: asyncio.DatagramTransport, addr: tuple[str, int], queue: asyncio.Queue[bytes], request: bytes
+	) -> bytes:
+		'''Sends a request and waits for its response (reassembling split responses), resending it if nothing comes back in time'''
+		for _ in range(self.retries + 1):
+			transport.sendto(request, addr)
+
+			packet = await self._packet(queue)
+			if packet is None: continue
+			if len(packet) < 5: raise QueryError(server, "Response too short")
+
+			header = int.from_bytes(packet[:4], "little", signed=True)
+			if header == SINGLE_HEADER: return packet
+			if header == SPLIT_HEADER: return await self._reassemble(server, queue, packet)
+			raise QueryError(server, "Invalid packet header")
+
+		raise QueryError(server, f"Connection failed after max retries ({self.retries})")
+
+	async def _reassemble(self, server: Server, queue: asyncio.Queue[bytes], first: bytes) -> bytes:
+		'''Collects the rest of a split response, returning the joined (and decompressed) payload'''
+		info = server._info
+		sizeField = not (info.get("protocol") == 7 and info.get("id") in NO_SIZE_IDS)
+		headerSize = 12 if sizeField else 10
+
+		packetID = int.from_bytes(first[4:8], "little", signed=True)
+		total = first[8] if len(first) > 9 else 0
+
+		def valid(packet: bytes) -> bool:
+			return len(packet) >= headerSize and packet[9] < total
+
+		if not valid(first): raise QueryError(server, "Invalid split packet")
+		packets = {first[9]: first}
+		while len(packets) < total:
+			packet = await self._packet(queue)
+			if packet is None: raise QueryError(server, "Timed out waiting for the rest of a split packet")
+
+			# Ignore duplicates of earlier responses resent after a timeout
+			if (
+				int.from_bytes(packet[:4], "little", signed=True) != SPLIT_HEADER or
+				int.from_bytes(packet[4:8], "little", signed=True) != packetID
+			): continue
+
+			if not valid(packet): raise QueryError(server, "Invalid split packet")
+			packets[packet[9]] = packet
+
+		payload = b"".join(packets[i][headerSize:] for i in range(total))
+
+		# Compressed payloads start with their decompressed size and CRC32
+		if packetID < 0:
+			if len(payload) < 8: raise QueryError(server, "Invalid compressed split packet")
+			size, crc = struct.unpack_from("<lL", payload)
+			try: payload = bz2.decompress(payload[8:])
+			except (OSError, ValueError): raise QueryError(server, "Failed to decompress split packet")
+
+			if len(payload) != size: raise QueryError(server, "Decompressed payload size does not match packet attribute")
+			if zlib.crc32(payload) != crc: raise QueryError(server, "Decompressed payload checksum does not match packet attribute")
+
+		return payload
+
+	async def _query(self, server: Server, request: bytes, challenge: bytes, expected: int) -> bytes:
+		'''Makes a request, answering any challenges, and returns the response if it's of the expected type'''
+		if server.isClosed: raise QueryError(server, "Request attempt made on closed connection")
+
+		addr = await self._resolve(server)
+		transport = await self._open()
+
+		lock = self._locks.setdefault(addr, asyncio.Lock())
+		async with lock:
+			queue: asyncio.Queue[bytes] = asyncio.Queue()
+			self._waiting[addr] = queue
+			try:
+				response = await self._exchange(server, transport, addr, queue, request + challenge)
+				for _ in range(self.CHALLENGE_RETRIES):
+					if len(response) != 9 or response[4] != CHALLENGE: break
+					response = await self._exchange(server, transport, addr, queue, request + response[5:])
+			finally:
+				del self._waiting[addr]
+
+		if len(response) < 5 or response[4] != expected: raise QueryError(server, "Response header invalid")
+		return response
+
+	def _cached(self, key: tuple[str, str]) -> tuple[bool, object]:
+		entry = self._cache.get(key)
+		if entry is None: return False, None
+
+		if entry[0] < time.monotonic():
+			del self._cache[key]
+			return False, None
+		return True, entry[1]
+
+	def _store(self, key: tuple[str, str], value, ttl: float):
+		if ttl > 0: self._cache[key] = (time.monotonic() + ttl, value)
+
+	async def _shared(self, key: tuple[str, str], fetch: Callable[[], Awaitable], ttl: float):
+		'''Gets a cached result, or fetches it while sharing a single query between concurrent callers for the same key'''
+		hit, value = self._cached(key)
+		if hit: return value
+
+		if key in self._inflight: return await asyncio.shield(self._inflight[key])
+
+		future = asyncio.get_running_loop().create_future()
+		self._inflight[key] = future
+		try:
+			value = await fetch()
+			self._store(key, value, ttl)
+			future.set_result(value)
+		except BaseException as e:
+			future.set_exception(e)
+			future.exception() # Mark as retrieved so lone failures don't get logged as unhandled
+			raise
+		finally:
+			del self._inflight[key]
+
+		return value
+
+	def forget(self, server: Server):
+		'''Drop everything cached for a server'''
+		for kind in ("info", "players", "rules"):
+			self._cache.pop((server.constr, kind), None)
+
+	async def info(self, server: Server) -> dict:
+		'''Gets the server's information (cached for the info TTL), see sourceserver's SourceServer.info'''
+		return await self._shared((server.constr, "info"), lambda: self._fetchInfo(server), self.cacheConfig.info)
+
+	async def ping(self, server: Server, places: int = 0) -> float:
+		'''
+		Times an info request to the server and returns it in milliseconds\n
+		Pings are never cached, but concurrent pings share a request and the response refreshes the cached info
+		'''
+		return round(await self._shared((server.constr, "ping"), lambda: self._timeInfo(server), 0) * 1000, places)
+
+	async def players(self, server: Server) -> tuple:
+		'''Gets every player on the server (cached for the players TTL), see sourceserver's SourceServer.getPlayers'''
+		return await self._shared((server.constr, "players"), lambda: self._fetchPlayers(server), self.cacheConfig.players)
+
+	async def rules(self, server: Server) -> dict:
+		'''Gets every rule on the server as a dictionary of name: value pairs (cached for the rules TTL)'''
+		return await self._shared((server.constr, "rules"), lambda: self._fetchRules(server), self.cacheConfig.rules)
+
+	async def retry(self, server: Server) -> bool:
+		'''Attempts to reconnect to a closed server, returning whether it's now open'''
+		if not server.isClosed: return True
+
+		server.isClosed = False
+		try: await self._timeInfo(server)
+		except SourceError:
+			server.isClosed = True
+			server._log("Failed to reconnect")
+		else:
+			server._log("Reconnected successfully")
+		return not server.isClosed
+
+	async def _fetchInfo(self, server: Server) -> dict:
+		response = await self._query(server, INFO_REQUEST, b"", INFO)
+		if len(response) < 23: raise QueryError(server, "Info response header invalid")
+
+		server._info = self._parseInfo(server, response[5:])
+		return server._info
+
+	async def _timeInfo(self, server: Server) -> float:
+		'''Makes an info request, caching the response and returning how long it took in seconds'''
+		start = time.monotonic()
+		info = await self._fetchInfo(server)
+		elapsed = time.monotonic() - start
+
+		self._store((server.constr, "info"), info, self.cacheConfig.info)
+		return elapsed
+
+	async def _fetchPlayers(self, server: Server) -> tuple:
+		info = await self.info(server)
+
+		response = await self._query(server, PLAYERS_REQUEST, NO_CHALLENGE, PLAYERS)
+		if len(response) < 6: raise QueryError(server, "Players response header invalid")
+
+		if info["game"] == "Counter-Strike: Global Offensive" and len(response) == 9:
+			return response[5], _Reader(server, response[6:]).float()
+
+		players = self._parsePlayers(server, response[6:], response[5], info["game"] == "The Ship")
+		return len(players), players
+
+	async def _fetchRules(self, server: Server) -> dict:
+		info = await self.info(server)
+		if info["game"] == "Counter-Strike: Global Offensive": raise QueryError(server, "CS:GO servers don't support rules requests")
+
+		response = await self._query(server, RULES_REQUEST, NO_CHALLENGE, RULES)
+		if len(response) < 7: raise QueryError(server, "Rules response header invalid")
+
+		reader = _Reader(server, response[5:])
+		return {reader.string(): reader.string() for _ in range(reader.short())}
+
+	@staticmethod
+	def _parseInfo(server: Server, data: bytes) -> dict:
+		reader = _Reader(server, data)
+
+		info = {
+			"protocol": reader.byte(),
+			"name": reader.string(), "map": reader.string(), "folder": reader.string(), "game": reader.string(),
+			"id": reader.short(),
+			"players": reader.byte(), "max_players": reader.byte(), "bots": reader.byte(),
+			"server_type": reader.byte(), "environment": reader.byte(), "visibility": reader.byte(), "VAC": reader.byte()
+		}
+		if info["game"] == "The Ship":
+			info.update({"mode": reader.byte(), "witnesses": reader.byte(), "duration": reader.byte()})
+		info["version"] = reader.string()
+		info["EDF"] = edf = reader.byte()
+
+		if edf is not None:
+			if edf & 0x80: info["port"] = reader.short()
+			if edf & 0x10: info["steam_id"] = reader.longlong()
+			if edf & 0x40:
+				info["sourceTV_port"] = reader.short()
+				info["sourceTV_name"] = reader.string()
+			if edf & 0x20: info["keywords"] = reader.string()
+			if edf & 0x01:
+				info["game_id"] = reader.longlong()
+				info["id"] = 16777215 & info["game_id"]
+
+		return info
+
+	@staticmethod
+	def _parsePlayers(server: Server, data: bytes, count: int, isTheShip: bool) -> tuple:
+		reader = _Reader(server, data)
+
+		if not isTheShip:
+			players = []
+			while not reader.atEnd:
+				players.append((reader.byte(), reader.string(), reader.long(), reader.float()))
+			return tuple(players)
+
+		# The Ship appends each player's deaths and money after the whole player list
+		players = tuple((reader.byte(), reader.string(), reader.long(), reader.float()) for _ in range(count))
+		return tuple(
+			player + (reader.long(), reader.long())
+			for player in players
+		)
@@ -1,23 +1,28 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
-from threading import Thread
-import atexit
+import asyncio
+import ipaddress
 import json
-from time import sleep
-import requests
 import re
 import socket
-from functools import partial
 
-infoPayloads = {}
-payloadDirty = {}
+from aiohttp import web, WSMsgType
 
-relayMsgs = {}
-sourceMsgs = {}
+from .avatars import AvatarResolver
+from .config import QueueConfig
+from .infopayload import InfoPayload
+from .relayqueue import RelayQueue
+from .utils import keepTask
 
-avatarPattern = re.compile(r"<avatarIcon><!\[CDATA\[(.*?)\]\]></avatarIcon>")
 conStringPattern = re.compile(r"(?P<hostname>.+):(?P<port>\d+)$")
 
+# Keys each type of event sent by a client must have
+EVENT_KEYS = {
+	"message": ("name", "message", "teamName", "teamColour"),
+	"join": ("name",),
+	"leave": ("name",),
+	"death": ("victim", "inflictor", "attacker", "suicide", "noweapon"),
+	"custom": ("body",)
+}
+
 # https://stackoverflow.com/a/28950776
 def get_ip():
 	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -32,204 +37,474 @@ def get_ip():
 		s.close()
 	return IP
 
-def relayThread(port, isRunningBehindCloudflare):
-	def onExit():
-		print("Relay thread shutdown")
-		try: server.shutdown()
-		except: print("Error closing server")
-
-	atexit.register(onExit)
-
-	# Define server
-	server = ThreadedHTTPServer(("", port), partial(Handler, isRunningBehindCloudflare))
-	print ("Started HTTP relay on port ", port)
-
-	# Listen indefinately for requests
-	server.serve_forever()
-
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-	pass
+class Relay(object):
+	'''HTTP and websocket chat relay for source servers, served on the bot's event loop'''
 
-class Handler(BaseHTTPRequestHandler):
-	def __init__(self, isRunningBehindCloudflare, *args, **kwargs) -> None:
+	def __init__(
+		self, port, isRunningBehindCloudflare,
+		dnsTTL: float = 300, maxLongPoll: float = 30, queueConfig: QueueConfig = QueueConfig()
+	):
+		self.port = port
 		self.isRunningBehindCloudflare = isRunningBehindCloudflare
+		self.dnsTTL = dnsTTL
+		self.maxLongPoll = maxLongPoll
+		self.queueConfig = queueConfig
+
+		self.infoPayloads: dict[str, InfoPayload | None] = {}
+		self.payloadDirty: dict[str, bool] = {}
+
+		self.relayMsgs: dict[str, dict[str, RelayQueue]] = {}
+		self.sourceMsgs: dict[str, dict[str, RelayQueue]] = {}
+
+		# Set whenever something is queued for a constring that its client hasn't collected yet
+		self._outbound: dict[str, asyncio.Event] = {}
+
+		# Constrings with events from their client waiting to be dispatched, and a flag to wake the dispatcher
+		self._inbound: set[str] = set()
+		self._inboundEvent = asyncio.Event()
+
+		self.avatars = AvatarResolver()
+
+		# Resolved (ip, port) -> constring index used to route requests, and the reverse for removal
+		self._routes: dict[tuple[str, str], str] = {}
+		self._routeKeys: dict[str, tuple[str, str]] = {}
+		self._resolving: set[asyncio.Task] = set()
+
+		self._lanIp: str | None = None
+		self._runner: web.AppRunner | None = None
+		self._refreshTask: asyncio.Task | None = None
+
+		# The game addons don't care about the path, so route every path to the same handlers (apart from member lookups)
+		self._app = web.Application()
+		self._app.router.add_route("POST", "/members", self.onMemberLookup)
+		self._app.router.add_route("GET", "/{path:.*}", self.onGet)
+		self._app.router.add_route("POST", "/{path:.*}", self.onPost)
+		self._app.router.add_route("PATCH", "/{path:.*}", self.onPatch)
+
+	async def start(self):
+		'''Start serving the relay on the running event loop'''
+		self._runner = web.AppRunner(self._app)
+		await self._runner.setup()
+
+		site = web.TCPSite(self._runner, port=self.port)
+		await site.start()
+		print("Started HTTP relay on port ", self.port)
+
+		await self.avatars.start()
+		self._refreshTask = asyncio.create_task(self._refreshRoutes())
+
+	async def stop(self):
+		'''Stop serving the relay, closing any open connections'''
+		if self._runner is None: return
+
+		if self._refreshTask is not None:
+			self._refreshTask.cancel()
+			self._refreshTask = None
+
+		await self._runner.cleanup()
+		await self.avatars.stop()
+		self._runner = None
+		print("Relay shutdown")
+
+	async def onGet(self, request: web.Request) -> web.StreamResponse:
+		'''
+		The "transmitter" for discord chat (and any flags)\n
+		Clients may send a Long-Poll header with a timeout in seconds to have the request held until there's something to send,
+		or upgrade to a websocket to stream events both ways over one connection
+		'''
+		if "Source-Port" not in request.headers:
+			return web.Response(status=400)
+
+		constring = self.getConString(request)
+		if not constring:
+			return web.Response(status=403)
 
-		super().__init__(*args, **kwargs)
+		if request.headers.get("Upgrade", "").lower() == "websocket":
+			return await self.onWebSocket(request, constring)
 
-	def do_GET(self):
-		'''The "transmitter" for discord chat (and any flags)'''
-		if "Source-Port" not in self.headers:
-			self.send_response(400)
-			self.end_headers()
-			return
+		if "Long-Poll" in request.headers:
+			try: timeout = min(float(request.headers["Long-Poll"]), self.maxLongPoll)
+			except ValueError: return web.Response(status=400, text="Long-Poll header must be a number of seconds")
 
-		constring = self.getConString(relayMsgs)
-		if not constring:
-			self.send_response(403)
-			self.end_headers()
-			return
+			try: await asyncio.wait_for(self._outbound[constring].wait(), timeout)
+			except asyncio.TimeoutError: pass
 
-		self.send_response(200)
-		self.send_header("Content-type", "application/json")
-		self.end_headers()
+			# The constring may have been removed while the request was held
+			if constring not in self.relayMsgs:
+				return web.Response(status=403)
 
-		self.wfile.write(bytes(json.dumps({
-			"messages": relayMsgs[constring],
-			"init-info-dirty": payloadDirty[constring]
-		}), encoding="utf-8"))
-		relayMsgs[constring] = {"chat": [], "rcon": []}
+		return web.json_response(self._collect(constring))
 
-	def do_POST(self):
+	async def onPost(self, request: web.Request) -> web.Response:
 		'''The "receiver" for source server chat'''
-		if "Source-Port" not in self.headers:
-			self.send_response(400)
-			self.end_headers()
-			return
+		if "Source-Port" not in request.headers:
+			return web.Response(status=400)
 
-		constring = self.getConString(sourceMsgs)
+		constring = self.getConString(request)
 		if not constring:
-			self.send_response(403)
-			self.end_headers()
-			return
-
-		if self.headers["Content-type"] != "application/json":
-			print(f"Request MIME type of {self.headers['Content-type']} is invalid")
-			self.send_error(400, explain=f"Request MIME type of {self.headers['Content-type']} is invalid")
-			self.end_headers()
-			return
+			return web.Response(status=403)
+
+		if request.headers.get("Content-type") != "application/json":
+			print(f"Request MIME type of {request.headers.get('Content-type')} is invalid")
+			return web.Response(status=400, text=f"Request MIME type of {request.headers.get('Content-type')} is invalid")
+
+		try: data = json.loads(await request.read())
+		except ValueError: return web.Response(status=400, text="Request body is not valid JSON")
+
+		# The constring may have been removed while we were waiting on the request body
+		if constring not in self.sourceMsgs:
+			return web.Response(status=403)
+
+		error = self._receive(constring, data)
+		if error:
+			return web.Response(status=400, text=error)
+
+		return web.Response(status=200)
+
+	async def onWebSocket(self, request: web.Request, constring: str) -> web.WebSocketResponse:
+		'''
+		Bidirectional transport for clients that keep a connection open\n
+		Incoming text frames take the same form as POST bodies, and outgoing frames the same form as GET responses
+		'''
+		ws = web.WebSocketResponse(heartbeat=30)
+		await ws.prepare(request)
+
+		sender = asyncio.create_task(self._streamOutbound(ws, constring))
+		try:
+			async for msg in ws:
+				if msg.type != WSMsgType.TEXT: continue
+				if constring not in self.sourceMsgs: break
+
+				try: data = json.loads(msg.data)
+				except ValueError:
+					await ws.send_json({"error": "Frame is not valid JSON"})
+					continue
+
+				error = self._receive(constring, data)
+				if error:
+					await ws.send_json({"error": error})
+		finally:
+			sender.cancel()
+
+		return ws
+
+	async def _streamOutbound(self, ws: web.WebSocketResponse, constring: str):
+		'''Pushes anything queued for a constring down its websocket as soon as it arrives'''
+		while True:
+			event = self._outbound.get(constring)
+			if event is None: break
+
+			await event.wait()
+			if constring not in self.relayMsgs: break
+
+			await ws.send_json(self._collect(constring))
+
+		await ws.close()
+
+	def _collect(self, constring: str) -> dict:
+		'''Drains everything queued for a constring's client'''
+		msgs = {kind: queue.drain() for kind, queue in self.relayMsgs[constring].items()}
+		self._outbound[constring].clear()
+
+		return {
+			"messages": msgs,
+			"init-info-dirty": self.payloadDirty[constring]
+		}
+
+	@staticmethod
+	def _validate(data) -> str | None:
+		'''Checks events sent by a client are an object of event objects with the keys their type needs, returning an error message if not'''
+		if not isinstance(data, dict) or not all(isinstance(event, dict) for event in data.values()):
+			return "Request must be an object of event objects"
+
+		for event in data.values():
+			if "type" not in event:
+				return "Request type param was not present"
+			if not isinstance(event["type"], str) or event["type"] not in EVENT_KEYS:
+				return f"Request type param was not valid, got {event['type']}"
+			if any(key not in event for key in EVENT_KEYS[event["type"]]):
+				return f"Request {event['type']} event is missing one of {', '.join(EVENT_KEYS[event['type']])}"
+			if event["type"] == "message" and "icon" not in event and "steamID" not in event:
+				return "Request message event needs an icon or steamID"
+
+	def _receive(self, constring: str, data) -> str | None:
+		'''Queues events sent by a constring's client, returning an error message if the events were invalid'''
+		# Checked up front so a bad event doesn't leave the ones before it queued
+		error = self._validate(data)
+		if error:
+			print(error)
+			return error
 
-		data = json.loads(self.rfile.read(int(self.headers.get("Content-Length"))))
 		for k in sorted(data):
-			if "type" not in data[k].keys():
-				print("Request type param was not present")
-				self.send_error(400, explain="Request type param was not present")
-				self.end_headers()
-				return
-
 			if data[k]["type"] == "message":
+				# Forward chat straight away, the avatar will be cached in time for the player's next message
 				if "icon" not in data[k]:
-					match = avatarPattern.search(requests.get(f"http://steamcommunity.com/profiles/{data[k]['steamID']}?xml=1").text)
-					if match is not None: match = match.group(1)
-					data[k]["icon"] = "http://example.com/" if match is None else match
+					data[k]["icon"] = self.avatars.get(data[k]["steamID"])
 
-				sourceMsgs[constring]["chat"].append(data[k])
+				self.sourceMsgs[constring]["chat"].put(data[k])
 			elif data[k]["type"] == "join":
-				sourceMsgs[constring]["joins"].append(data[k]["name"])
+				self.sourceMsgs[constring]["joins"].put(data[k]["name"])
 			elif data[k]["type"] == "leave":
-				sourceMsgs[constring]["leaves"].append(data[k]["name"])
+				self.sourceMsgs[constring]["leaves"].put(data[k]["name"])
 			elif data[k]["type"] == "death":
-				sourceMsgs[constring]["deaths"].append((data[k]["victim"], data[k]["inflictor"], data[k]["attacker"], data[k]["suicide"] == "1", data[k]["noweapon"] == "1"))
+				self.sourceMsgs[constring]["deaths"].put((data[k]["victim"], data[k]["inflictor"], data[k]["attacker"], data[k]["suicide"] == "1", data[k]["noweapon"] == "1"))
 			elif data[k]["type"] == "custom":
-				sourceMsgs[constring]["custom"].append(data[k]["body"])
-			else:
-				print(f"Request type param was not valid, got {data[k]['type']}")
-				self.send_error(400, explain="Request type param was not valid")
-				self.end_headers()
-				return
-
-		self.send_response(200)
-		self.end_headers()
-		return
-	
-	def do_PATCH(self):
-		'''Request to get the info payload'''
-		if "Source-Port" not in self.headers:
-			self.send_response(400)
-			self.end_headers()
-			return
-
-		constring = self.getConString(sourceMsgs)
+				self.sourceMsgs[constring]["custom"].put(data[k]["body"])
+
+			self._inbound.add(constring)
+			self._inboundEvent.set()
+
+	async def onPatch(self, request: web.Request) -> web.Response:
+		'''
+		Request to get the info payload\n
+		The payload's version is sent in the Info-Version header, and clients that send back the last version they saw
+		in the same header are sent only the changes since then (unless too much has changed, then the full payload is sent)\n
+		Full payloads are tagged with an ETag for If-None-Match requests, and are gzipped for clients that accept it
+		'''
+		if "Source-Port" not in request.headers:
+			return web.Response(status=400)
+
+		constring = self.getConString(request)
+		if not constring:
+			return web.Response(status=403)
+
+		payload = self.infoPayloads[constring]
+		self.payloadDirty[constring] = False
+		if payload is None:
+			return web.Response(text="")
+
+		headers = {"Info-Version": str(payload.version)}
+		if "Info-Version" in request.headers:
+			try: since = int(request.headers["Info-Version"])
+			except ValueError: return web.Response(status=400, text="Info-Version header must be an integer")
+
+			delta = payload.delta(since)
+			if delta is not None:
+				return web.Response(text=delta, headers=headers)
+
+		await payload.encodeAsync()
+		headers["ETag"] = payload.etag
+		if self._etagMatches(request.headers.get("If-None-Match"), payload.etag):
+			return web.Response(status=304, headers=headers)
+
+		headers["Vary"] = "Accept-Encoding"
+		if self._acceptsGzip(request.headers.get("Accept-Encoding")):
+			headers["Content-Encoding"] = "gzip"
+			return web.Response(body=await payload.encodeCompressedAsync(), content_type="text/plain", charset="utf-8", headers=headers)
+
+		return web.Response(text=payload.encode(), headers=headers)
+
+	async def onMemberLookup(self, request: web.Request) -> web.Response:
+		'''
+		Request to look up a few members of the info payload, so clients don't need the whole member table\n
+		The body is a JSON object with a list of member "ids" and/or a list of name "prefixes" (and optionally a "limit" of matches per prefix),
+		and the matching members are sent along with the roles they have
+		'''
+		if "Source-Port" not in request.headers:
+			return web.Response(status=400)
+
+		constring = self.getConString(request)
 		if not constring:
-			self.send_response(403)
-			self.end_headers()
+			return web.Response(status=403)
+
+		if request.headers.get("Content-type") != "application/json":
+			return web.Response(status=400, text=f"Request MIME type of {request.headers.get('Content-type')} is invalid")
+
+		try: data = json.loads(await request.read())
+		except ValueError: return web.Response(status=400, text="Request body is not valid JSON")
+
+		if not isinstance(data, dict):
+			return web.Response(status=400, text="Request body must be an object")
+
+		ids = data.get("ids", [])
+		prefixes = data.get("prefixes", [])
+		limit = data.get("limit", InfoPayload.MAX_LOOKUP_MATCHES)
+		if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+			return web.Response(status=400, text="ids must be a list of strings")
+		if not isinstance(prefixes, list) or not all(isinstance(prefix, str) for prefix in prefixes):
+			return web.Response(status=400, text="prefixes must be a list of strings")
+		if not isinstance(limit, int):
+			return web.Response(status=400, text="limit must be an integer")
+
+		# The constring may have been removed while we were waiting on the request body
+		payload = self.infoPayloads.get(constring)
+		if payload is None:
+			return web.Response(text="")
+
+		return web.Response(text=payload.lookup(ids, prefixes, limit), content_type="application/json")
+
+	@staticmethod
+	def _etagMatches(ifNoneMatch: str | None, etag: str) -> bool:
+		if not ifNoneMatch: return False
+		if ifNoneMatch.strip() == "*": return True
+
+		# Weak comparison, as the payload doesn't change between encodings
+		return etag in (tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(","))
+
+	@staticmethod
+	def _acceptsGzip(acceptEncoding: str | None) -> bool:
+		if not acceptEncoding: return False
+
+		for coding in acceptEncoding.split(","):
+			name, _, params = coding.partition(";")
+			if name.strip().lower() != "gzip": continue
+
+			# A quality of 0 means the client explicitly refuses gzip
+			quality = 1.0
+			for param in params.split(";"):
+				key, _, value = param.strip().partition("=")
+				if key != "q": continue
+
+				try: quality = float(value)
+				except ValueError: pass
+			return quality > 0
+		return False
+
+	def getOriginIp(self, request: web.Request) -> str:
+		if self.isRunningBehindCloudflare and "CF-Connecting-IP" in request.headers:
+			return request.headers["CF-Connecting-IP"]
+
+		if request.remote != '127.0.0.1':
+			return request.remote
+
+		if self._lanIp is None: self._lanIp = get_ip()
+		return self._lanIp
+
+	def getConString(self, request: web.Request) -> str | None:
+		return self._routes.get((self.getOriginIp(request), request.headers['Source-Port']))
+
+	def _setRoute(self, constring: str, key: tuple[str, str]):
+		'''Point a resolved (ip, port) at a constring, replacing any previous route for it'''
+		self._dropRoute(constring)
+		self._routes[key] = constring
+		self._routeKeys[constring] = key
+
+	def _dropRoute(self, constring: str):
+		key = self._routeKeys.pop(constring, None)
+		if key is not None and self._routes.get(key) == constring:
+			del self._routes[key]
+
+	async def _resolve(self, constring: str):
+		'''Resolve a constring's hostname and index it, keeping the old route if resolution fails'''
+		match = conStringPattern.match(constring)
+		if not match: return
+
+		try:
+			addresses = await asyncio.get_running_loop().getaddrinfo(
+				match.group("hostname"), None,
+				family=socket.AF_INET, type=socket.SOCK_DGRAM
+			)
+		except socket.gaierror:
+			print(f"Failed to resolve {constring}")
 			return
 
-		self.send_response(200)
-		self.end_headers()
+		# The constring may have been removed while we were resolving it
+		if constring not in self.sourceMsgs or not addresses: return
+		self._setRoute(constring, (addresses[0][4][0], match.group("port")))
 
-		self.wfile.write(bytes(infoPayloads[constring], encoding="utf-8"))
-		payloadDirty[constring] = False
-	
-	def getOriginIp(self):
-		if self.isRunningBehindCloudflare and "CF-Connecting-IP" in self.headers:
-			return self.headers["CF-Connecting-IP"]
+	async def _refreshRoutes(self):
+		'''Periodically re-resolve hostnames so servers that change IP are still routed'''
+		while True:
+			await asyncio.sleep(self.dnsTTL)
 
-		if self.client_address[0] != '127.0.0.1':
-			return self.client_address[0]
+			hostnames = [constring for constring in self.sourceMsgs if not self._isLiteral(constring)]
+			await asyncio.gather(*[self._resolve(constring) for constring in hostnames])
 
-		return get_ip()
+	@staticmethod
+	def _isLiteral(constring: str) -> bool:
+		match = conStringPattern.match(constring)
+		if not match: return False
 
-	def getConString(self, messageDict: dict[str, dict]):
-		originIp = self.getOriginIp()
-		originPort = self.headers['Source-Port']
+		try: ipaddress.IPv4Address(match.group("hostname"))
+		except ValueError: return False
+		return True
 
-		for conString in messageDict.keys():
-			match = conStringPattern.match(conString)
-			if not match:
-				continue
+	def setInitPayload(self, constring: str, payload: InfoPayload):
+		'''Set the payload to be sent when a client performs an init request, it's only encoded when requested'''
+		self.infoPayloads[constring] = payload
+		self.payloadDirty[constring] = True
+		if constring in self._outbound: self._outbound[constring].set()
 
-			ip = socket.gethostbyname(match.group("hostname"))
-			port = match.group("port")
-			if ip == originIp and port == originPort:
-				return conString
-
-class Relay(object):
-	'''HTTP chat relay for source servers'''
-
-	def __init__(self, port, isRunningBehindCloudflare):
-		print("Starting relay thread")
-		self.t = Thread(target=relayThread, args=(port, isRunningBehindCloudflare))
-		self.t.daemon = True
-		self.t.start()
-	
-	def setInitPayload(self, constring: str, payload: str):
-		'''Set the payload to be sent when a client performs an init request'''
-		infoPayloads[constring] = payload
-		payloadDirty[constring] = True
+	def _makeQueue(self, kind: str) -> RelayQueue:
+		return RelayQueue(self.queueConfig.capacity[kind], self.queueConfig.policy, self.queueConfig.ttl)
 
 	def addConStr(self, constring: str):
-		relayMsgs[constring] = {"chat": [], "rcon": []}
-		sourceMsgs[constring] = {"chat": [], "joins": [], "leaves": [], "deaths": [], "custom": []}
-		infoPayloads[constring] = ""
-		payloadDirty[constring] = False
+		self.relayMsgs[constring] = {kind: self._makeQueue(kind) for kind in ("chat", "rcon")}
+		self.sourceMsgs[constring] = {kind: self._makeQueue(kind) for kind in ("chat", "joins", "leaves", "deaths", "custom")}
+		self.infoPayloads[constring] = None
+		self.payloadDirty[constring] = False
+		self._outbound[constring] = asyncio.Event()
+
+		# IP literals can be indexed straight away, anything else needs a DNS lookup
+		if self._isLiteral(constring):
+			match = conStringPattern.match(constring)
+			self._setRoute(constring, (match.group("hostname"), match.group("port")))
+		else:
+			keepTask(self._resolving, asyncio.get_running_loop().create_task(self._resolve(constring)))
+
 	def removeConStr(self, constring: str):
-		del relayMsgs[constring]
-		del sourceMsgs[constring]
-		del infoPayloads[constring]
-		del payloadDirty[constring]
+		self._dropRoute(constring)
+		del self.relayMsgs[constring]
+		del self.sourceMsgs[constring]
+		del self.infoPayloads[constring]
+		del self.payloadDirty[constring]
+		self._inbound.discard(constring)
+
+		# Release any held requests so they can see the constring is gone
+		self._outbound.pop(constring).set()
 
 	def isConStrAdded(self, constring: str) -> bool:
-		return constring in infoPayloads
+		return constring in self.infoPayloads
 
 	def addMessage(self, msg: tuple, constring: str):
-		relayMsgs[constring]["chat"].append(msg)
+		self.relayMsgs[constring]["chat"].put(msg)
+		self._outbound[constring].set()
 
 	def addRCON(self, command: str, constring: str):
-		relayMsgs[constring]["rcon"].append(command)
+		self.relayMsgs[constring]["rcon"].put(command)
+		self._outbound[constring].set()
+
+	def markPending(self, constring: str):
+		'''Flag a constring as having events to dispatch again, such as ones that couldn't be dispatched yet'''
+		if not self.isConStrAdded(constring): return
+
+		self._inbound.add(constring)
+		self._inboundEvent.set()
+
+	async def waitForEvents(self) -> set[str]:
+		'''Waits until clients have sent events, then returns the constrings that have some to dispatch'''
+		await self._inboundEvent.wait()
+		self._inboundEvent.clear()
+
+		pending, self._inbound = self._inbound, set()
+		return pending
 
 	def getMessages(self, constring: str) -> list:
-		ret = sourceMsgs[constring]["chat"]
-		sourceMsgs[constring]["chat"] = []
-		return ret
+		return self.sourceMsgs[constring]["chat"].drain()
 
 	def getJoinsAndLeaves(self, constring: str) -> tuple:
-		ret = (sourceMsgs[constring]["joins"], sourceMsgs[constring]["leaves"])
-		sourceMsgs[constring]["joins"] = []
-		sourceMsgs[constring]["leaves"] = []
-		return ret
+		return (self.sourceMsgs[constring]["joins"].drain(), self.sourceMsgs[constring]["leaves"].drain())
 
 	def getDeaths(self, constring: str) -> list:
-		ret = sourceMsgs[constring]["deaths"]
-		sourceMsgs[constring]["deaths"] = []
-		return ret
+		return self.sourceMsgs[constring]["deaths"].drain()
 
 	def getCustom(self, constring: str) -> list[str]:
-		ret = sourceMsgs[constring]["custom"]
-		sourceMsgs[constring]["custom"] = []
-		return ret
+		return self.sourceMsgs[constring]["custom"].drain()
+
+	def getDropped(self, constring: str) -> dict[str, dict[str, int]]:
+		'''Gets how many events of each kind have been dropped or expired for a constring since it was added'''
+		return {
+			"discord": {kind: queue.dropped + queue.expired for kind, queue in self.relayMsgs[constring].items()},
+			"source": {kind: queue.dropped + queue.expired for kind, queue in self.sourceMsgs[constring].items()}
+		}
 
 if __name__ == "__main__":
-	r = Relay(8080)
-	try:
-		while True: sleep(10)
-	except KeyboardInterrupt: pass
\ No newline at end of file
+	async def main():
+		r = Relay(8080, False)
+		await r.start()
+		try:
+			while True: await asyncio.sleep(10)
+		finally: await r.stop()
+
+	try: asyncio.run(main())
+	except KeyboardInterrupt: pass
@@ -0,0 +1,58 @@
+from collections import deque
+from enum import Enum
+import time
+
+class DropPolicy(Enum):
+	Oldest = "drop-oldest"
+	Newest = "drop-newest"
+
+class RelayQueue(object):
+	'''
+	Bounded FIFO of relay events for one constring and event kind\n
+	When full, either the oldest queued event or the incoming one is dropped depending on the policy,
+	and events that sit uncollected for longer than the TTL are expired
+	'''
+
+	def __init__(self, capacity: int, policy: DropPolicy = DropPolicy.Oldest, ttl: float | None = None):
+		self.capacity = capacity
+		self.policy = policy
+		self.ttl = ttl
+
+		self.dropped = 0
+		self.expired = 0
+
+		self._items: deque[tuple[float, object]] = deque()
+
+	def __len__(self) -> int:
+		return len(self._items)
+
+	def _expire(self, now: float):
+		'''Remove events older than the TTL from the front of the queue'''
+		if self.ttl is None: return
+
+		while self._items and now - self._items[0][0] > self.ttl:
+			self._items.popleft()
+			self.expired += 1
+
+	def put(self, item) -> bool:
+		'''Queue an event, returning False if it (or the oldest event) was dropped to make room'''
+		now = time.monotonic()
+		self._expire(now)
+
+		if len(self._items) < self.capacity:
+			self._items.append((now, item))
+			return True
+
+		self.dropped += 1
+		if self.policy == DropPolicy.Newest or not self._items: return False
+
+		self._items.popleft()
+		self._items.append((now, item))
+		return False
+
+	def drain(self) -> list:
+		'''Take every unexpired event from the queue'''
+		self._expire(time.monotonic())
+		items, self._items = self._items, deque()
+
+		return [item for _, item in items]
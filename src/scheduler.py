@@ -0,0 +1,199 @@
+import asyncio
+from dataclasses import dataclass, field
+from enum import IntEnum
+import heapq
+import itertools
+import time
+import traceback
+
+from .interface import Embed, IChannel, IUser, Masquerade
+from .config import SchedulerConfig
+
+class Priority(IntEnum):
+	'''Send priority classes, lower values are sent first'''
+	Outage = 0
+	Chat = 1
+	Presence = 2 # joins and leaves
+	Event = 3 # deaths and custom events
+	Log = 4 # followed log lines
+
+# Messages of these priorities are dropped once they've waited longer than the latency budget, with the note summarising them
+SHEDDABLE = {
+	Priority.Event: "message{s} dropped to keep up with the server",
+	Priority.Log: "log message{s} dropped to keep up with the log"
+}
+
+class TokenBucket(object):
+	'''Allows bursts of up to burst sends, refilling at rate tokens per second'''
+
+	def __init__(self, rate: float, burst: int):
+		self.rate = rate
+		self.burst = burst
+
+		self._tokens = float(burst)
+		self._updated = time.monotonic()
+
+	def _refill(self):
+		now = time.monotonic()
+		self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def delay(self) -> float:
+		'''Time until a token is available'''
+		self._refill()
+		if self._tokens >= 1: return 0
+		return (1 - self._tokens) / self.rate
+
+	def untilFull(self) -> float:
+		self._refill()
+		return (self.burst - self._tokens) / self.rate
+
+	def take(self):
+		self._refill()
+		self._tokens -= 1
+
+@dataclass(order=True)
+class _Send:
+	priority: Priority
+	seq: int
+	queued: float = field(compare=False)
+	target: IChannel | IUser = field(compare=False)
+	content: str | None = field(compare=False)
+	masquerade: Masquerade | None = field(compare=False)
+	embed: Embed | None = field(compare=False)
+	future: asyncio.Future | None = field(compare=False)
+	sheddable: bool = field(compare=False, default=True)
+
+@dataclass
+class WaitStats:
+	sent: int = 0
+	shed: int = 0
+	totalWait: float = 0
+	maxWait: float = 0
+
+	@property
+	def meanWait(self) -> float:
+		return self.totalWait / self.sent if self.sent else 0
+
+class SendScheduler(object):
+	'''
+	Queues outbound messages per channel or user, sending them in priority order within a token bucket budget\n
+	When events or followed log lines have waited longer than the latency budget they're dropped and replaced with a summary of each
+	'''
+
+	SHED_INTERVAL = 1
+
+	def __init__(self, config: SchedulerConfig = SchedulerConfig()):
+		self.config = config
+
+		self._queues: dict[str, list[_Send]] = {}
+		self._buckets: dict[str, TokenBucket] = {}
+		self._workers: dict[str, asyncio.Task] = {}
+		self._lastShed: dict[str, float] = {}
+		self._seq = itertools.count()
+
+		self.stats: dict[Priority, WaitStats] = {priority: WaitStats() for priority in Priority}
+
+	def _enqueue(self, item: _Send):
+		route = item.target.id
+		if route not in self._queues: self._queues[route] = []
+		if route not in self._buckets: self._buckets[route] = TokenBucket(self.config.rate, self.config.burst)
+
+		heapq.heappush(self._queues[route], item)
+		if route not in self._workers:
+			self._workers[route] = asyncio.create_task(self._work(route))
+
+	def submit(
+		self, target: IChannel | IUser, content: str | None = None, masquerade: Masquerade | None = None, embed: Embed | None = None,
+		priority: Priority = Priority.Chat
+	):
+		'''Queue a message without waiting for it to be sent, errors are logged'''
+		self._enqueue(_Send(priority, next(self._seq), time.monotonic(), target, content, masquerade, embed, None))
+
+	async def send(
+		self, target: IChannel | IUser, content: str | None = None, masquerade: Masquerade | None = None, embed: Embed | None = None,
+		priority: Priority = Priority.Chat
+	):
+		'''Queue a message and wait for it to be sent, returning None if it was shed'''
+		future = asyncio.get_running_loop().create_future()
+		self._enqueue(_Send(priority, next(self._seq), time.monotonic(), target, content, masquerade, embed, future))
+		return await future
+
+	def _shed(self, route: str):
+		'''Drop sheddable messages that have blown the latency budget, queueing a summary of each priority in their place'''
+		now = time.monotonic()
+		if now - self._lastShed.get(route, 0) < self.SHED_INTERVAL: return
+		self._lastShed[route] = now
+
+		queue = self._queues[route]
+		kept, shed = [], {priority: [] for priority in SHEDDABLE}
+		for item in queue:
+			if item.priority in SHEDDABLE and item.sheddable and now - item.queued > self.config.latencyBudget:
+				shed[item.priority].append(item)
+			else:
+				kept.append(item)
+		if not any(shed.values()): return
+
+		for priority, items in shed.items():
+			if not items: continue
+
+			for item in items:
+				if item.future is not None and not item.future.done(): item.future.set_result(None)
+			self.stats[priority].shed += len(items)
+
+			kept.append(_Send(
+				priority, min(item.seq for item in items), now, items[0].target,
+				f"*{len(items)} {SHEDDABLE[priority].format(s='s' if len(items) != 1 else '')}*",
+				None, None, None, sheddable=False
+			))
+
+		heapq.heapify(kept)
+		self._queues[route] = kept
+
+	async def _work(self, route: str):
+		bucket = self._buckets[route]
+		try:
+			while self._queues[route]:
+				self._shed(route)
+
+				delay = bucket.delay()
+				if delay > 0:
+					# Re-check priorities after waiting, something more important may have been queued
+					await asyncio.sleep(delay)
+					continue
+				bucket.take()
+
+				item = heapq.heappop(self._queues[route])
+
+				wait = time.monotonic() - item.queued
+				stats = self.stats[item.priority]
+				stats.sent += 1
+				stats.totalWait += wait
+				stats.maxWait = max(stats.maxWait, wait)
+
+				try:
+					result = await item.target.send(item.content, item.masquerade, item.embed)
+				except Exception as err:
+					if item.future is None: traceback.print_exception(type(err), err, err.__traceback__)
+					elif not item.future.done(): item.future.set_exception(err)
+				else:
+					if item.future is not None and not item.future.done(): item.future.set_result(result)
+		finally:
+			del self._workers[route]
+			if not self._queues[route]:
+				del self._queues[route]
+				self._lastShed.pop(route, None)
+
+				# A full bucket is the same as a new one, so forget it once it's refilled rather than keeping one for every route ever used
+				asyncio.get_running_loop().call_later(bucket.untilFull(), self._dropBucket, route)
+
+	def _dropBucket(self, route: str):
+		if route not in self._queues and route in self._buckets and self._buckets[route].untilFull() <= 0:
+			del self._buckets[route]
+
+	def summary(self) -> str:
+		'''Describes how long each priority has waited to be sent and how much has been shed, for tuning the budget'''
+		return ", ".join(
+			f"{priority.name}: {stats.sent} sent, {stats.shed} shed, {stats.meanWait:.2f}s mean wait, {stats.maxWait:.2f}s max wait"
+			for priority, stats in self.stats.items()
+		)
@@ -0,0 +1,83 @@
+import asyncio
+import codecs
+from dataclasses import dataclass
+import os
+import signal
+import traceback
+from typing import Awaitable, Callable
+
+KILL_GRACE = 5 # Seconds to wait for the rest of the output once a command's been killed
+
+@dataclass
+class CommandResult:
+	returncode: int | None
+	output: str # Tail of stdout and stderr
+	timedOut: bool
+
+async def runCommand(
+	command: str, onOutput: Callable[[str], Awaitable],
+	timeout: float = 300, interval: float = 2, keep: int = 1900
+) -> CommandResult:
+	'''
+	Runs a shell command without blocking the event loop, with stderr merged into stdout\n
+	onOutput is called with the latest keep characters of output at most once per interval while it changes,
+	and the command (along with anything it started) is killed if it runs for longer than timeout seconds
+	'''
+	process = await asyncio.create_subprocess_shell(
+		command,
+		stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+		start_new_session=True # Own process group, so the whole tree can be killed on timeout
+	)
+
+	output = ""
+	changed = asyncio.Event()
+	decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") # Chunks may split multibyte characters
+
+	async def read():
+		nonlocal output
+		while True:
+			chunk = await process.stdout.read(4096)
+			if not chunk: break
+
+			# Only the tail is ever shown, so don't hold on to any more than that
+			output = (output + decoder.decode(chunk))[-keep:]
+			changed.set()
+
+	async def stream():
+		while True:
+			await changed.wait()
+			changed.clear()
+
+			try: await onOutput(output)
+			except Exception as err: traceback.print_exception(type(err), err, err.__traceback__)
+			await asyncio.sleep(interval)
+
+	reader = asyncio.create_task(read())
+	streamer = asyncio.create_task(stream())
+	timedOut = False
+	try:
+		try: await asyncio.wait_for(asyncio.shield(reader), timeout)
+		except asyncio.TimeoutError:
+			timedOut = True
+			_kill(process)
+
+			# Anything that left the process group can still hold the output open, so only wait so long for it
+			try: await asyncio.wait_for(reader, KILL_GRACE)
+			except asyncio.TimeoutError: pass
+		await process.wait()
+	except BaseException:
+		_kill(process)
+		reader.cancel()
+		raise
+	finally:
+		streamer.cancel()
+
+	return CommandResult(process.returncode, output, timedOut)
+
+def _kill(process: asyncio.subprocess.Process):
+	if process.returncode is not None: return
+
+	try:
+		if hasattr(os, "killpg"): os.killpg(process.pid, signal.SIGKILL)
+		else: process.kill()
+	except ProcessLookupError: pass
@@ -1,5 +1,10 @@
+import asyncio
 from datetime import timedelta
 from dataclasses import dataclass
+import re
+import time
+import traceback
+from typing import Callable, Hashable
 
 @dataclass
 class Colour:
@@ -26,3 +31,69 @@ def formatTimedelta(delta: timedelta) -> str:
 	if minutes != 0: datetimeStr.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
 	if seconds != 0: datetimeStr.append(f"{seconds} second{'s' if seconds != 1 else ''}")
 	return " ".join(datetimeStr)
+
+durationPattern = re.compile(r"(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>[mhdwy])", re.IGNORECASE)
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+def parseDuration(text: str) -> float | None:
+	'''Parses a duration like 30m, 6h, 7d, 2w or 1y into seconds, returning None if it's invalid'''
+	match = durationPattern.fullmatch(text.strip())
+	if not match: return None
+	return float(match.group("amount")) * DURATION_UNITS[match.group("unit").lower()]
+
+def keepTask(tasks: set[asyncio.Task], task: asyncio.Task) -> asyncio.Task:
+	'''Holds on to a background task in tasks until it's done so it isn't garbage collected, printing its exception if it fails'''
+	def done(task: asyncio.Task):
+		tasks.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			err = task.exception()
+			traceback.print_exception(type(err), err, err.__traceback__)
+
+	tasks.add(task)
+	task.add_done_callback(done)
+	return task
+
+def packMessages(messages: list[tuple[str, object]], limit: int = 2000) -> list[tuple[str, object]]:
+	'''
+	Joins runs of adjacent (content, sender) pairs with equal senders into as few newline separated messages as fit in limit\n
+	Ordering is preserved, and messages already over the limit are passed through untouched
+	'''
+	packed = []
+	for content, sender in messages:
+		if packed and packed[-1][1] == sender and len(packed[-1][0]) + 1 + len(content) <= limit:
+			packed[-1] = (packed[-1][0] + "\n" + content, sender)
+		else:
+			packed.append((content, sender))
+	return packed
+
+class Debouncer(object):
+	'''
+	Coalesces bursts of triggers for a key into a single callback\n
+	The callback runs once no triggers have arrived for window seconds, or maxLatency seconds after the first trigger at the latest
+	'''
+
+	def __init__(self, window: float, maxLatency: float, callback: Callable[[Hashable], None]):
+		self.window = window
+		self.maxLatency = maxLatency
+		self.callback = callback
+
+		# key -> (time of first trigger, scheduled flush)
+		self._pending: dict[Hashable, tuple[float, asyncio.TimerHandle]] = {}
+
+	def trigger(self, key: Hashable):
+		if self.window <= 0:
+			self.callback(key)
+			return
+
+		now = time.monotonic()
+		first = now
+		if key in self._pending:
+			first, handle = self._pending[key]
+			handle.cancel()
+
+		delay = max(0, min(self.window, first + self.maxLatency - now))
+		self._pending[key] = (first, asyncio.get_running_loop().call_later(delay, self._flush, key))
+
+	def _flush(self, key: Hashable):
+		del self._pending[key]
+		self.callback(key)
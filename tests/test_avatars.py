@@ -0,0 +1,99 @@
+import asyncio
+
+from aiohttp import web
+
+from src.avatars import AvatarResolver, DEFAULT_AVATAR
+
+def avatarURL(steamID: str) -> str:
+	return f"https://avatars.example.com/{steamID}_full.jpg"
+
+class FakeSteam(object):
+	'''
+	Steam community profile stub on localhost, answering ?xml=1 profile requests with an avatar\n
+	IDs in missing get a 404, and every response is held for delay seconds so concurrent lookups overlap
+	'''
+
+	def __init__(self, missing: frozenset[str] = frozenset(), delay: float = 0):
+		self.missing = missing
+		self.delay = delay
+		self.requests: list[str] = []
+
+	async def onProfile(self, request: web.Request) -> web.Response:
+		steamID = request.match_info["steamID"]
+		self.requests.append(steamID)
+		await asyncio.sleep(self.delay)
+
+		if steamID in self.missing: return web.Response(status=404)
+		return web.Response(text=f"<profile><avatarIcon><![CDATA[{avatarURL(steamID)}]]></avatarIcon></profile>", content_type="text/xml")
+
+def run(test, resolver: dict | None = None, **fake):
+	'''Runs a test coroutine against a fresh fake steam and a started avatar resolver pointed at it'''
+	async def main():
+		steam = FakeSteam(**fake)
+		app = web.Application()
+		app.router.add_get("/profiles/{steamID}", steam.onProfile)
+
+		runner = web.AppRunner(app)
+		await runner.setup()
+		site = web.TCPSite(runner, "127.0.0.1", 0)
+		await site.start()
+
+		host, port = runner.addresses[0][:2]
+		avatars = AvatarResolver(f"http://{host}:{port}/", **(resolver or {}))
+		await avatars.start()
+		try: return await test(avatars, steam)
+		finally:
+			await avatars.stop()
+			await runner.cleanup()
+
+	return asyncio.run(main())
+
+def testCacheHit():
+	async def test(avatars: AvatarResolver, steam: FakeSteam):
+		assert await avatars.resolve("1") == avatarURL("1")
+		assert await avatars.resolve("1") == avatarURL("1")
+		assert avatars.get("1") == avatarURL("1")
+		assert steam.requests == ["1"]
+
+	run(test)
+
+def testNegativeCache():
+	async def test(avatars: AvatarResolver, steam: FakeSteam):
+		assert await avatars.resolve("2") == DEFAULT_AVATAR
+		assert await avatars.resolve("2") == DEFAULT_AVATAR
+		assert steam.requests == ["2"]
+
+		# Failures are only remembered for the negative TTL
+		await asyncio.sleep(0.1)
+		assert await avatars.resolve("2") == DEFAULT_AVATAR
+		assert steam.requests == ["2", "2"]
+
+	run(test, resolver={"negativeTTL": 0.05}, missing=frozenset({"2"}))
+
+def testConcurrentLookupsShareRequest():
+	async def test(avatars: AvatarResolver, steam: FakeSteam):
+		results = await asyncio.gather(*[avatars.resolve("3") for _ in range(5)])
+		assert results == [avatarURL("3")] * 5
+		assert steam.requests == ["3"]
+
+	run(test, delay=0.1)
+
+def testGetResolvesInBackground():
+	async def test(avatars: AvatarResolver, steam: FakeSteam):
+		assert avatars.get("4") == DEFAULT_AVATAR
+		assert avatars.get("4") == DEFAULT_AVATAR # Already queued, not looked up twice
+
+		await asyncio.sleep(0.2)
+		assert avatars.get("4") == avatarURL("4")
+		assert steam.requests == ["4"]
+
+	run(test, resolver={"batchDelay": 0.01})
+
+def testLeastRecentlyUsedEvicted():
+	async def test(avatars: AvatarResolver, steam: FakeSteam):
+		for steamID in ("5", "6", "5", "7"): await avatars.resolve(steamID)
+		assert await avatars.resolve("5") == avatarURL("5")
+		assert await avatars.resolve("6") == avatarURL("6")
+		assert steam.requests == ["5", "6", "7", "6"]
+
+	run(test, resolver={"maxSize": 2})
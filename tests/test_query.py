@@ -0,0 +1,174 @@
+import asyncio
+import bz2
+import struct
+import zlib
+
+import pytest
+
+from src.config import QueryCacheConfig
+from src.data import Server
+from src.query import QueryEngine, QueryError
+
+CHALLENGE = b"\x12\x34\x56\x78"
+
+def packString(value: str) -> bytes:
+	return value.encode("utf-8") + b"\x00"
+
+INFO_RESPONSE = (
+	b"\xFF\xFF\xFF\xFFI" + bytes([17]) +
+	packString("Test Server") + packString("cp_badlands") + packString("tf") + packString("Team Fortress") +
+	struct.pack("<h", 440) + bytes([2, 24, 0]) + b"dl" + bytes([0, 1]) +
+	packString("1.0") + bytes([0x80]) + struct.pack("<h", 27015)
+)
+
+PLAYERS = [(0, "alice", 10, 61.5), (1, "bob", -2, 3.25)]
+PLAYERS_RESPONSE = b"\xFF\xFF\xFF\xFFD" + bytes([len(PLAYERS)]) + b"".join(
+	bytes([index]) + packString(name) + struct.pack("<lf", score, duration) for index, name, score, duration in PLAYERS
+)
+
+RULES = {f"sv_rule{i}": str(i) * 20 for i in range(100)}
+RULES_RESPONSE = b"\xFF\xFF\xFF\xFFE" + struct.pack("<h", len(RULES)) + b"".join(
+	packString(name) + packString(value) for name, value in RULES.items()
+)
+
+def split(payload: bytes, packetID: int, size: int = 400, compressed: bool = False, crc: int | None = None) -> list[bytes]:
+	'''Splits a response into the multi-packet format, optionally bz2 compressed with its size and checksum up front'''
+	if compressed:
+		packetID |= 0x80000000
+		payload = struct.pack("<lL", len(payload), zlib.crc32(payload) if crc is None else crc) + bz2.compress(payload)
+
+	parts = [payload[i:i + size] for i in range(0, len(payload), size)]
+	return [
+		struct.pack("<lLBBh", -2, packetID, len(parts), number, size) + part
+		for number, part in enumerate(parts)
+	]
+
+class FakeServer(asyncio.DatagramProtocol):
+	'''
+	A2S responder on localhost, which challenges every request without a challenge number\n
+	Players come back split and rules split and compressed, drop is how many requests to ignore before answering,
+	and mangle can alter the packets of a response before they're sent
+	'''
+
+	def __init__(self, drop: int = 0, mangle=None):
+		self.drop = drop
+		self.mangle = mangle
+		self.requests: list[bytes] = []
+
+	def connection_made(self, transport: asyncio.DatagramTransport):
+		self.transport = transport
+
+	def datagram_received(self, data: bytes, addr: tuple):
+		self.requests.append(data)
+		if self.drop > 0:
+			self.drop -= 1
+			return
+
+		kind = data[4:5]
+		challenge = data[-4:]
+		if challenge != CHALLENGE:
+			self.transport.sendto(b"\xFF\xFF\xFF\xFFA" + CHALLENGE, addr)
+			return
+
+		if kind == b"T": packets = [INFO_RESPONSE]
+		elif kind == b"U": packets = split(PLAYERS_RESPONSE, 1, size=16)
+		elif kind == b"V": packets = split(RULES_RESPONSE, 2, compressed=True)
+		else: return
+
+		if self.mangle is not None: packets = self.mangle(packets)
+		for packet in packets: self.transport.sendto(packet, addr)
+
+def makeServer(port: int) -> Server:
+	'''A Server that hasn't connected, as the engine does all its own networking'''
+	server = Server.__new__(Server)
+	server.constr = f"127.0.0.1:{port}"
+	server._hostname, server._port = "127.0.0.1", port
+	server.isClosed = False
+	server._info = {}
+	return server
+
+def run(test, **fake):
+	'''Runs a test coroutine against a fresh fake server and query engine'''
+	async def main():
+		transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+			lambda: FakeServer(**fake), local_addr=("127.0.0.1", 0)
+		)
+		engine = QueryEngine(timeout=0.2, retries=1, cacheConfig=QueryCacheConfig(0, 0, 0))
+		try: return await test(engine, makeServer(transport.get_extra_info("sockname")[1]), protocol)
+		finally:
+			engine.close()
+			transport.close()
+
+	return asyncio.run(main())
+
+def testInfoAnswersChallenge():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		info = await engine.info(server)
+		assert info["name"] == "Test Server"
+		assert info["map"] == "cp_badlands"
+		assert info["players"] == 2 and info["max_players"] == 24
+		assert info["port"] == 27015
+		assert [request[-4:] for request in fake.requests] == [b"Query\x00"[-4:], CHALLENGE]
+
+	run(test)
+
+def testSplitPlayers():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		count, players = await engine.players(server)
+		assert count == 2
+		assert [(index, name, score) for index, name, score, _ in players] == [(0, "alice", 10), (1, "bob", -2)]
+		assert players[0][3] == pytest.approx(61.5)
+
+	run(test)
+
+def testSplitPacketsOutOfOrder():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		count, _ = await engine.players(server)
+		assert count == 2
+
+	run(test, mangle=lambda packets: packets[::-1])
+
+def testCompressedRules():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		assert await engine.rules(server) == RULES
+
+	run(test)
+
+def testCompressedChecksumMismatch():
+	def corrupt(packets: list[bytes]) -> list[bytes]:
+		if packets[0][:4] != b"\xFE\xFF\xFF\xFF": return packets
+		payload = b"".join(packet[12:] for packet in packets)
+		return split(bz2.decompress(payload[8:]), 2, compressed=True, crc=0)
+
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		with pytest.raises(QueryError, match="checksum"): await engine.rules(server)
+
+	run(test, mangle=corrupt)
+
+def testMissingSplitPacketTimesOut():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		with pytest.raises(QueryError, match="rest of a split packet"): await engine.players(server)
+
+	run(test, mangle=lambda packets: packets[:-1] if len(packets) > 1 else packets)
+
+def testResendsAfterTimeout():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		assert (await engine.info(server))["name"] == "Test Server"
+		assert len(fake.requests) == 3 # Dropped, challenged, answered
+
+	run(test, drop=1)
+
+def testGivesUpAfterRetries():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		with pytest.raises(QueryError, match="max retries"): await engine.ping(server)
+		assert len(fake.requests) == engine.retries + 1
+
+	run(test, drop=100)
+
+def testConcurrentCallersShareQuery():
+	async def test(engine: QueryEngine, server: Server, fake: FakeServer):
+		results = await asyncio.gather(*[engine.info(server) for _ in range(5)])
+		assert all(result == results[0] for result in results)
+		assert len(fake.requests) == 2
+
+	run(test)